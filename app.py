@@ -1,15 +1,16 @@
 import streamlit as st
 import pandas as pd
 import os
-import json
 import numpy as np
 from datetime import datetime, timedelta
-from sklearn.cluster import AgglomerativeClustering
 from pathlib import Path
 import base64
 
 # Import your custom clustering module
-from clustering import compute_tfidf
+from clustering import cluster_tfidf, compute_tfidf, load_cluster_index
+from cache import CACHE_BACKEND, archived_dates, article_facets, load_archive, query_articles
+from search import load_search_index
+from snapshot import HEADER_FIELDS, TEXT_FIELDS, fetch_text, filter_snapshot, load_snapshot, snapshot_facets
 
 st.set_page_config(layout='wide', initial_sidebar_state='expanded')
 
@@ -17,23 +18,73 @@ ARTICLES_CACHE_FILE = 'article_cache.json'
 LOGO_PATH = 'app/Cat.jpg'
 KEYWORD_LOGO_PATH = 'app/logo.jpg'
 
-@st.cache_data(ttl=3600)  # Cache the data for 1 hour
-def load_articles_from_cache(cache_file):
+@st.cache_data(ttl=600)  # Refreshed with the snapshot table
+def load_articles_from_cache(cache_file, start_date=None, end_date=None, sentiment=None):
     try:
-        if os.path.exists(cache_file):
-            with open(cache_file, 'r') as f:
-                articles = json.load(f)
-            return pd.DataFrame(articles.values())
+        if CACHE_BACKEND == 'sqlite':
+            # The date and sentiment indexes answer the filter; records come with their text
+            articles = query_articles(start_date, end_date, sentiments=[sentiment] if sentiment else None)
+            return pd.DataFrame([{**{field: article.get(field) for field in HEADER_FIELDS},
+                                  **{field: article.get(field) or '' for field in TEXT_FIELDS}} for article in articles],
+                                columns=HEADER_FIELDS + list(TEXT_FIELDS))
+        elif os.path.exists(cache_file):
+            # Metadata columns only, from the memory-mapped snapshot; text is fetched per displayed article
+            table = filter_snapshot(load_table(), start_date, end_date, sentiments=[sentiment] if sentiment else None)
+            return pd.DataFrame(table.select(HEADER_FIELDS).to_pylist())
         else:
             return pd.DataFrame()
     except Exception as e:
         st.error(f"Error loading cache: {e}")
         return pd.DataFrame()
 
-def filter_articles_by_keywords(articles, keywords):
+@st.cache_resource(ttl=600)
+def load_table():
+    return load_snapshot(ARTICLES_CACHE_FILE)
+
+@st.cache_data(ttl=3600)
+def load_archived_articles(start_date, end_date, sentiment=None):
+    # Full records, text included, from the archive partitions in the date range
+    articles = [
+        article for article in load_archive(start_date, end_date).values()
+        if not sentiment or article.get('sentiment_category') == sentiment
+    ]
+    return pd.DataFrame(articles, columns=HEADER_FIELDS + list(TEXT_FIELDS))
+
+@st.cache_resource(ttl=600)
+def load_search(archive_start=None, archive_end=None):
+    index = load_search_index(ARTICLES_CACHE_FILE)
+    # Archived articles in the range go into this private copy of the index
+    if archive_start:
+        for url, article in load_archive(archive_start, archive_end).items():
+            index.add_article(url, article)
+    return index
+
+@st.cache_data(ttl=600)
+def load_index():
+    return load_cluster_index()
+
+@st.cache_data(ttl=600)
+def load_article_facets(cache_file):
+    try:
+        # SQLite answers from its indexes, without mapping the snapshot
+        return article_facets() if CACHE_BACKEND == 'sqlite' else snapshot_facets(load_table())
+    except Exception as e:
+        st.error(f"Error loading cache: {e}")
+        return {'count': 0}
+
+def filter_articles_by_keywords(articles, keywords, search_index=None):
     if not isinstance(keywords, list):
         keywords = [keywords] if keywords else []
 
+    if search_index is not None:
+        # Answer from the inverted index: an article matches if any keyword query matches it
+        matches = [search_index.search(keyword) for keyword in keywords if keyword]
+        matches = [urls for urls in matches if urls is not None]
+        if not matches:
+            return articles
+        urls = set().union(*matches)
+        return [article for article in articles if article.get('url') in urls]
+
     filtered_articles = []
     for article in articles:
         body = article.get('body', '')
@@ -42,6 +93,13 @@ def filter_articles_by_keywords(articles, keywords):
     
     return filtered_articles
 
+def attach_text(articles_df, field):
+    # Live articles read the field from the snapshot blob; archived rows already carry it
+    texts = fetch_text(articles_df['url'], [field])
+    current = articles_df[field] if field in articles_df.columns else pd.Series('', index=articles_df.index)
+    values = [texts[url][field] if url in texts else (value if isinstance(value, str) else '') for url, value in zip(articles_df['url'], current)]
+    return articles_df.assign(**{field: values})
+
 def filter_articles_by_date_and_sentiment(articles_df, start_date, end_date, sentiment):
     if 'date' in articles_df.columns:
         articles_df['date'] = pd.to_datetime(articles_df['date'])
@@ -54,27 +112,35 @@ def filter_articles_by_date_and_sentiment(articles_df, start_date, end_date, sen
 
     return articles_df
 
-def cluster_articles(articles_df, keyword):
-    if 'body' not in articles_df.columns:
-        st.error("Missing 'body' column in the articles data.")
+def cluster_articles(articles_df, keyword, search_index=None):
+    if 'url' not in articles_df.columns:
+        st.error("Missing 'url' column in the articles data.")
         return pd.DataFrame(), []
 
-    articles_df['body'] = articles_df['body'].astype(str).fillna('')
-
     if keyword:
-        articles_df = articles_df[articles_df['body'].str.contains(keyword, case=False, na=False)]
+        matches = search_index.search(keyword) if search_index is not None else None
+        if matches is not None:
+            articles_df = articles_df[articles_df['url'].isin(matches)]
+        else:
+            bodies = attach_text(articles_df, 'body')['body']
+            articles_df = articles_df[[keyword.lower() in body.lower() for body in bodies]]
 
     if articles_df.empty:
         return pd.DataFrame(), []
 
     articles_df.fillna('', inplace=True)
 
-    tfidf_df = compute_tfidf(articles_df)
-    distance_threshold = 1.5
-    ac = AgglomerativeClustering(distance_threshold=distance_threshold, n_clusters=None)
-    articles_labeled = ac.fit_predict(tfidf_df)
-
-    articles_df['cluster_id'] = articles_labeled
+    # Use the stories precomputed by clustering.py; only articles it has not seen yet are clustered here
+    cluster_index = load_index()
+    index_ids = cluster_index['articles'] if cluster_index else {}
+    articles_df['cluster_id'] = [int(index_ids[url]) if url in index_ids else -1 for url in articles_df['url']]
+    unindexed = articles_df['cluster_id'] < 0
+    if unindexed.any():
+        unindexed_df = attach_text(articles_df[unindexed], 'clean_body')
+        tfidf_matrix = compute_tfidf(unindexed_df, dense=False)
+        first_new_id = max((int(cluster_id) for cluster_id in cluster_index['clusters']), default=-1) + 1 if cluster_index else 0
+        articles_df.loc[unindexed, 'cluster_id'] = cluster_tfidf(tfidf_matrix, distance_threshold=1.5) + first_new_id
+    articles_labeled = articles_df['cluster_id'].values
     clusters = {str(n): articles_df[articles_df['cluster_id'] == n].to_dict(orient='records') for n in np.unique(articles_labeled)}
 
     return articles_df, clusters
@@ -85,11 +151,22 @@ def truncate_summary(summary, word_limit=100):
         return ' '.join(words[:word_limit]) + '...'
     return summary
 
+def collapse_duplicates(articles_df):
+    # Syndicated copies fold into their original when both are shown; the original lists their sources
+    if 'duplicate_of' not in articles_df.columns:
+        return articles_df
+    copies = articles_df[articles_df['duplicate_of'].isin(articles_df['url'])]
+    also_published_by = copies.groupby('duplicate_of')['source'].apply(lambda sources: ', '.join(sorted(set(sources))))
+    articles_df = articles_df.drop(copies.index)
+    return articles_df.assign(also_published_by=articles_df['url'].map(also_published_by).fillna(''))
+
 def display_articles(articles_df, clusters, clusters_per_row=3):
     if articles_df.empty:
         st.write("No articles found with the given keyword or current date.")
         return
 
+    articles_df = collapse_duplicates(articles_df)
+
     grouped = articles_df.groupby('cluster_id')
     cluster_ids = sorted(grouped.groups.keys())
 
@@ -119,6 +196,8 @@ def display_articles(articles_df, clusters, clusters_per_row=3):
 
                         st.write(f"Frequent Words: {', '.join(article.get('keywords', []))}")
                         st.write(f"Sentiment: {article.get('sentiment_category')}")
+                        if article.get('also_published_by'):
+                            st.write(f"Also published by: {article['also_published_by']}")
                         st.write(f"Cluster ID: {article.get('cluster_id')}")
                         st.write("---")
                         displayed_articles += 1
@@ -141,6 +220,8 @@ def display_articles(articles_df, clusters, clusters_per_row=3):
 
                             st.write(f"Frequent Words: {', '.join(article.get('keywords', []))}")
                             st.write(f"Sentiment: {article.get('sentiment_category')}")
+                            if article.get('also_published_by'):
+                                st.write(f"Also published by: {article['also_published_by']}")
                             st.write(f"Cluster ID: {article.get('cluster_id')}")
                             st.write("---")
 
@@ -182,17 +263,22 @@ if __name__ == '__main__':
         
         keyword = st.text_input("Search articles by keyword")
 
-        articles_df = load_articles_from_cache(ARTICLES_CACHE_FILE)
+        facets = load_article_facets(ARTICLES_CACHE_FILE)
         
-        if not articles_df.empty:
-            articles_df['date'] = pd.to_datetime(articles_df['date'])
-            min_date = articles_df['date'].min().date()
-            max_date = articles_df['date'].max().date()
+        if facets['count']:
+            min_date = pd.to_datetime(facets['min_date']).date()
+            max_date = pd.to_datetime(facets['max_date']).date()
         else:
             st.error("No articles found in cache.")
             min_date = datetime.today().date() - timedelta(days=30)
             max_date = datetime.today().date()
 
+        # Archived articles are only opened when asked for; they widen the date range
+        archive_dates = archived_dates()
+        include_archive = bool(archive_dates) and st.checkbox("Include archived articles")
+        if include_archive:
+            min_date = min(min_date, pd.to_datetime(archive_dates[0]).date())
+
         # Date filter slider with dynamic date range
         start_date, end_date = st.slider(
             "Filter articles by publication date",
@@ -209,17 +295,28 @@ if __name__ == '__main__':
             format_func=lambda x: "All" if x == "" else x.capitalize()
         )
 
+    # Only pull the rows inside the selected date range and sentiment
+    articles_df = load_articles_from_cache(ARTICLES_CACHE_FILE, start_date, end_date, sentiment)
+    search_index = load_search()
+    if include_archive:
+        articles_df = pd.concat([articles_df, load_archived_articles(start_date, end_date, sentiment)], ignore_index=True)
+        search_index = load_search(start_date, end_date)
+
     if keyword:
-        filtered_articles = filter_articles_by_keywords(articles_df.to_dict(orient='records'), [keyword])
+        filtered_articles = filter_articles_by_keywords(articles_df.to_dict(orient='records'), [keyword], search_index)
         filtered_articles_df = pd.DataFrame(filtered_articles)
     else:
         filtered_articles_df = articles_df
 
     filtered_articles_df = filter_articles_by_date_and_sentiment(filtered_articles_df, start_date, end_date, sentiment)
+
+    # Summaries are only read for the articles that made it through the filters
+    if not filtered_articles_df.empty:
+        filtered_articles_df = attach_text(filtered_articles_df, 'summary')
     
     # Display metrics in a column layout
     col1, col2 = st.columns(2)
-    total_articles_scraped = len(articles_df)
+    total_articles_scraped = facets['count']
     total_articles_filtered = len(filtered_articles_df)
     col1.metric("Total Articles Scraped", total_articles_scraped)
     col2.metric("Total Articles Based on Filter", total_articles_filtered)
@@ -229,6 +326,6 @@ if __name__ == '__main__':
     st.write("Articles by Source")
     st.table(articles_by_source)
 
-    filtered_articles_df, clusters = cluster_articles(filtered_articles_df, keyword)
+    filtered_articles_df, clusters = cluster_articles(filtered_articles_df, keyword, search_index)
     
     display_articles(filtered_articles_df, clusters)
@@ -0,0 +1,74 @@
+import argparse
+import json
+import os
+import string
+import sys
+import time
+
+import pandas as pd
+from nltk.corpus import stopwords
+from nltk.stem import SnowballStemmer
+from nltk.tokenize import word_tokenize
+from unidecode import unidecode
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import normalizer
+from cache import load_articles
+from scrapper import clean_articles
+
+# Benchmark the single-pass normalizer against the original seven-pass clean_articles.
+# Usage: python benchmarks/bench_clean_articles.py [--scale N] [--workers N]
+
+def legacy_clean_articles(news_df):
+    news_df['clean_body'] = news_df['body'].str.lower()
+    stop_words = set(stopwords.words('english'))
+    news_df['clean_body'] = news_df['clean_body'].apply(lambda x: ' '.join([word for word in x.split() if word.lower() not in stop_words]))
+    news_df['clean_body'] = news_df['clean_body'].apply(lambda x: x.translate(str.maketrans('', '', string.punctuation)))
+    news_df['clean_body'] = news_df['clean_body'].apply(lambda x: ''.join([i for i in x if not i.isdigit()]))
+    news_df['clean_body'] = news_df['clean_body'].apply(unidecode)
+    news_df['clean_body'] = news_df['clean_body'].apply(word_tokenize)
+    stemmer = SnowballStemmer(language='english')
+    news_df['clean_body'] = news_df['clean_body'].apply(lambda x: ' '.join([stemmer.stem(y) for y in x]))
+
+    return news_df
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cache-file', default='article_cache.json')
+    parser.add_argument('--scale', type=int, default=1, help='repeat the corpus this many times')
+    parser.add_argument('--workers', type=int, default=None, help='process pool size for the batched run')
+    args = parser.parse_args()
+
+    bodies = [article['body'] for article in load_articles(args.cache_file).values()] * args.scale
+    print(f'{len(bodies)} bodies, {sum(len(body) for body in bodies) / 1e6:.1f}M characters')
+
+    legacy_df, legacy_time = timed(legacy_clean_articles, pd.DataFrame({'body': bodies}))
+
+    normalizer.normalize_word.cache_clear()
+    normalizer.stem.cache_clear()
+    fast_df, fast_time = timed(clean_articles, pd.DataFrame({'body': bodies}))
+    word_cache = normalizer.normalize_word.cache_info()
+
+    pooled, pooled_time = timed(normalizer.normalize_texts, bodies, args.workers)
+
+    mismatches = sum(a != b for a, b in zip(legacy_df['clean_body'], fast_df['clean_body']))
+    mismatches += sum(a != b for a, b in zip(legacy_df['clean_body'], pooled))
+
+    print(json.dumps({
+        'articles': len(bodies),
+        'legacy_seconds': round(legacy_time, 3),
+        'single_pass_seconds': round(fast_time, 3),
+        'process_pool_seconds': round(pooled_time, 3),
+        'speedup': round(legacy_time / fast_time, 2),
+        'word_cache_hit_rate': round(word_cache.hits / max(1, word_cache.hits + word_cache.misses), 3),
+        'mismatches': mismatches,
+    }, indent=4))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+import argparse
+import importlib.util
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+from datetime import date, timedelta
+
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import clustering
+import normalizer
+from cache import load_articles
+from scrapper import clean_articles
+from search import build_search_index
+from snapshot import HEADER_FIELDS, filter_snapshot, load_snapshot, write_snapshot
+
+# Time and peak traced memory of the clustering and UI data paths on synthetic corpora
+# resampled from the article store. One JSON line per corpus size; --output also writes
+# them with the commit they were measured at, for comparing runs between commits.
+# Peak memory is what tracemalloc sees: Python and numpy allocations in this process,
+# not Arrow buffers or the normalizer's worker processes. Tracing slows allocation-heavy
+# stages severalfold, so --time-only skips it when only timings are compared.
+# Usage: python benchmarks/bench_scaling.py [--sizes 1000 10000 100000] [--cluster-max 10000] [--output results.json]
+
+def synthetic_corpus(articles, size, seed=42):
+    # Each synthetic article splices the title and body words of two stored ones, under a
+    # unique url and a date spread over the last month
+    rng = random.Random(seed)
+    stored = [article for article in articles if article.get('title') and article.get('body')]
+    today = date.today()
+    corpus = {}
+    urls = []
+    for i in range(size):
+        first, second = rng.choice(stored), rng.choice(stored)
+        title_words = first['title'].split()
+        title = ' '.join(title_words[:max(4, len(title_words) * 2 // 3)] + second['title'].split()[:3])
+        first_body, second_body = first['body'].split(' '), second['body'].split(' ')
+        body = ' '.join(first_body[:int(len(first_body) * 0.7)] + second_body[int(len(second_body) * 0.7):])
+        url = f'{first["url"]}#synthetic-{i}'
+        urls.append(url)
+        corpus[url] = {
+            **first,
+            'url': url,
+            'title': title,
+            'body': body,
+            'clean_body': None,
+            'date': (today - timedelta(days=rng.randrange(30))).isoformat(),
+            'keywords': list(first.get('keywords') or [])[:5] + list(second.get('keywords') or [])[:5],
+            'duplicate_of': urls[rng.randrange(i)] if i and rng.random() < 0.02 else None,
+        }
+    return corpus
+
+TRACE_MEMORY = True
+
+def measure(func, *args):
+    normalizer.normalize_word.cache_clear()
+    normalizer.stem.cache_clear()
+    if TRACE_MEMORY:
+        tracemalloc.start()
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - start
+    if not TRACE_MEMORY:
+        return result, {'seconds': round(elapsed, 3)}
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, {'seconds': round(elapsed, 3), 'peak_mb': round(peak / 2**20, 1)}
+
+def tfidf_clustering(news_df):
+    return clustering.cluster_tfidf(clustering.compute_tfidf(news_df, dense=False))
+
+def main_page(table, search_index, sources, sentiments, query):
+    # The filtering and aggregation main.py runs as a Streamlit script on every interaction
+    articles = filter_snapshot(table, sources=sources, sentiments=sentiments).to_pylist()
+    search_matches = search_index.search(query)
+    filtered_articles = [article for article in articles if search_matches is None or article['url'] in search_matches]
+    filtered_sources = [article['source'] for article in filtered_articles]
+    filtered_keywords = [keyword for article in filtered_articles for keyword in article.get('keywords', [])]
+    filtered_sentiments = [article['sentiment_category'] for article in filtered_articles]
+    source_counts = pd.DataFrame({'Source': filtered_sources})['Source'].value_counts().reset_index()
+    sentiment_counts = pd.DataFrame({'Sentiment': filtered_sentiments, 'Source': filtered_sources})
+    sentiment_counts = sentiment_counts.groupby(['Source', 'Sentiment']).size().reset_index(name='Count')
+    keyword_counts = pd.DataFrame({'Keyword': filtered_keywords})['Keyword'].value_counts().reset_index()
+    return len(filtered_articles), len(source_counts), len(sentiment_counts), len(keyword_counts)
+
+def homepage(homepage_module, table, search_index, start_date, end_date, query):
+    # Homepage's sidebar path: date-filtered headers, keyword matches clustered, copies collapsed
+    articles_df = pd.DataFrame(filter_snapshot(table, start_date, end_date).select(HEADER_FIELDS).to_pylist())
+    articles_df = homepage_module.filter_articles_by_date_and_sentiment(articles_df, start_date, end_date, None)
+    articles_df, clusters = homepage_module.cluster_articles(articles_df, query, search_index)
+    if not articles_df.empty:
+        articles_df = homepage_module.collapse_duplicates(articles_df)
+    return len(articles_df), len(clusters)
+
+def load_homepage():
+    # pages/Homepage.py is a Streamlit page; importing it outside `streamlit run` only defines its functions
+    spec = importlib.util.spec_from_file_location('Homepage', os.path.join(ROOT, 'pages', 'Homepage.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def common_keyword(corpus, rank=10):
+    counts = Counter(keyword for article in corpus.values() for keyword in article.get('keywords') or [])
+    ranked = [keyword for keyword, _ in counts.most_common(rank)]
+    return ranked[-1] if ranked else ''
+
+def current_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_size(articles, size, args, homepage_module):
+    corpus = synthetic_corpus(articles, size, args.seed)
+    query = args.query or common_keyword(corpus)
+    result = {'articles': size, 'query': query, 'stages': {}}
+    stages = result['stages']
+
+    news_df = pd.DataFrame(list(corpus.values()))
+    news_df, stages['clean_articles'] = measure(clean_articles, news_df)
+    if size <= args.cluster_max:
+        labels, stages['tfidf_clustering'] = measure(tfidf_clustering, news_df)
+        stages['tfidf_clustering']['clusters'] = int(len(set(labels)))
+    if size <= args.kmeans_max:
+        clusters, stages['kmeans_titles'] = measure(clustering.cluster_articles, news_df['title'].tolist(), 5)
+
+    # The UI paths read the files scrapper.py writes, built here in a scratch directory
+    for url, clean_body in zip(news_df['url'], news_df['clean_body']):
+        corpus[url]['clean_body'] = clean_body
+    with open('article_cache.json', 'w') as f:
+        json.dump(corpus, f)
+    _, stages['write_snapshot'] = measure(write_snapshot)
+    search_index, stages['build_search_index'] = measure(build_search_index)
+    table, stages['load_snapshot'] = measure(load_snapshot)
+
+    sources = sorted({article['source'] for article in corpus.values()})
+    _, stages['main_filter'] = measure(main_page, table, search_index, sources, ['positive', 'negative', 'neutral'], query)
+    start_date = (date.today() - timedelta(days=7)).isoformat()
+    _, stages['homepage_filter'] = measure(homepage, homepage_module, table, search_index, start_date, date.today().isoformat(), query)
+    return result
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cache-file', default='article_cache.json')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--cluster-max', type=int, default=100000, help='largest corpus to run TF-IDF clustering on')
+    parser.add_argument('--kmeans-max', type=int, default=100000, help='largest corpus to run KMeans on titles on')
+    parser.add_argument('--query', help='search keyword for the UI paths; defaults to a common stored keyword')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--time-only', action='store_true', help='skip tracemalloc, which slows the timed stages')
+    parser.add_argument('--output', help='also write all results to this JSON file')
+    args = parser.parse_args()
+
+    global TRACE_MEMORY
+    TRACE_MEMORY = not args.time_only
+
+    articles = list(load_articles(os.path.abspath(args.cache_file)).values())
+    homepage_module = load_homepage()
+    results = []
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        for size in args.sizes:
+            result = run_size(articles, size, args, homepage_module)
+            results.append(result)
+            print(json.dumps(result), flush=True)
+        os.chdir(cwd)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'commit': current_commit(), 'results': results}, f, indent=4)
+
+if __name__ == '__main__':
+    main()
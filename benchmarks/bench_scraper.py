@@ -0,0 +1,205 @@
+import argparse
+import html
+import json
+import os
+import random
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cache import load_articles
+
+# End-to-end Scraper.scrape throughput against a local stand-in for the news sites. Stored
+# articles are served back as RSS feeds and article pages, one HTTP server per source so the
+# per-domain limit applies as it would live. Each corpus size is scraped in a fresh process,
+# into an empty cache, so peak RSS is per size.
+# Usage: python benchmarks/bench_scraper.py [--sizes 50 200 1000] [--latency 0.05] [--error-rate 0.02] [--timeout-rate 0.01]
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        site = self.server.site
+        page = site['pages'].get(self.path)
+        if page is None:
+            self.send_error(404)
+            return
+        if self.path in site['hanging']:
+            # Longer than the scraper's request timeout
+            time.sleep(site['timeout'] + 1)
+        elif site['latency']:
+            time.sleep(random.uniform(site['latency'] * (1 - site['jitter']), site['latency'] * (1 + site['jitter'])))
+        if self.path in site['failing']:
+            self.send_error(500)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/rss+xml' if self.path.endswith('.xml') else 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(page)))
+        self.end_headers()
+        try:
+            self.wfile.write(page)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+def slug(source):
+    return re.sub(r'\W+', '-', source.lower()).strip('-')
+
+def article_page(article):
+    title = html.escape(article.get('title') or '')
+    paragraphs = ''.join(f'<p>{html.escape(line)}</p>' for line in (article.get('body') or '').split('\n') if line.strip())
+    image = f'<meta property="og:image" content="{html.escape(article["image_url"])}">' if article.get('image_url') else ''
+    return (f'<html><head><title>{title}</title>{image}</head>'
+            f'<body><article><h1>{title}</h1>{paragraphs}</article></body></html>').encode()
+
+def rss_feed(items):
+    entries = ''.join(
+        f'<item><title>{html.escape(title)}</title><link>{html.escape(link)}</link>'
+        f'<guid>{html.escape(link)}</guid><pubDate>{published}</pubDate></item>'
+        for title, link, published in items
+    )
+    return f'<?xml version="1.0"?><rss version="2.0"><channel><title>fixture</title>{entries}</channel></rss>'.encode()
+
+def corpus(articles, size, seed=42):
+    # Stored articles with a usable body, repeated when the size exceeds the store
+    usable = [article for article in articles if article.get('title') and len((article.get('body') or '').split()) > 20]
+    random.Random(seed).shuffle(usable)
+    return [usable[i % len(usable)] for i in range(size)]
+
+def start_sites(records, args):
+    # One server per source; returns the sources.json for the fixture and the servers
+    rng = random.Random(args.seed)
+    now = datetime.now(timezone.utc)
+    by_source = {}
+    for i, article in enumerate(records):
+        by_source.setdefault(article.get('source') or 'unknown', []).append((i, article))
+
+    sources, servers = {}, []
+    for source, items in by_source.items():
+        site = {'pages': {}, 'failing': set(), 'hanging': set(),
+                'latency': args.latency, 'jitter': args.jitter, 'timeout': args.timeout}
+        server = ThreadingHTTPServer(('127.0.0.1', 0), FixtureHandler)
+        server.daemon_threads = True
+        server.site = site
+        base = f'http://127.0.0.1:{server.server_port}'
+        feed_items = []
+        for i, article in items:
+            path = f'/{slug(source)}/{i}.html'
+            site['pages'][path] = article_page(article)
+            roll = rng.random()
+            if roll < args.error_rate:
+                site['failing'].add(path)
+            elif roll < args.error_rate + args.timeout_rate:
+                site['hanging'].add(path)
+            published = format_datetime(now - timedelta(minutes=i), usegmt=True)
+            feed_items.append((article['title'], f'{base}{path}', published))
+        # Feeds are split the way sources list several RSS urls
+        feeds = [feed_items[start:start + args.feed_size] for start in range(0, len(feed_items), args.feed_size)]
+        sources[source] = {'rss': []}
+        for n, entries in enumerate(feeds):
+            path = f'/{slug(source)}/feed{n}.xml'
+            site['pages'][path] = rss_feed(entries)
+            sources[source]['rss'].append(f'{base}{path}')
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+    return sources, servers
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+def scrape_fixture(workdir, args):
+    # Runs in the child process, from inside workdir
+    os.chdir(workdir)
+    import scrapper
+    from cache import CacheManager
+
+    started = {}
+    stored = {}
+
+    class TimedScraper(scrapper.Scraper):
+        def download_article(self, link, domain_slots, source=None):
+            started.setdefault(link, time.perf_counter())
+            return super().download_article(link, domain_slots, source)
+
+    class TimedCache(CacheManager):
+        def add_article(self, url, article):
+            stored[url] = time.perf_counter()
+            super().add_article(url, article)
+
+    with open('sources.json', 'r') as f:
+        sources = json.load(f)
+    scrapper.config.request_timeout = args.timeout
+    cache_manager = TimedCache('article_cache.json')
+    scraper = TimedScraper(sources, 7, cache_manager, args.workers, args.per_domain, None, args.analysis_workers or None)
+    start = time.perf_counter()
+    scraper.scrape()
+    elapsed = time.perf_counter() - start
+
+    latencies = [stored[url] - started[url] for url in stored if url in started]
+    summary = scraper.run.as_dict()
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {
+        'seconds': round(elapsed, 2),
+        'stored': len(stored),
+        'failed': sum(summary['failures_by_domain'].values()),
+        'articles_per_s': round(len(stored) / elapsed, 2) if elapsed else None,
+        'p50_latency': round(percentile(latencies, 0.5), 3) if latencies else None,
+        'p95_latency': round(percentile(latencies, 0.95), 3) if latencies else None,
+        # ru_maxrss is in KiB on Linux
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'worker_peak_rss_mb': round(children.ru_maxrss / 1024, 1),
+        'stage_wall': {stage: stats['wall'] for stage, stats in summary['stages'].items()},
+    }
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cache-file', default='article_cache.json')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[50, 200, 1000])
+    parser.add_argument('--latency', type=float, default=0.05, help='mean seconds per response')
+    parser.add_argument('--jitter', type=float, default=0.5, help='latency varies by this fraction either way')
+    parser.add_argument('--error-rate', type=float, default=0.02, help='share of article pages answering 500')
+    parser.add_argument('--timeout-rate', type=float, default=0.01, help='share of article pages that never answer in time')
+    parser.add_argument('--timeout', type=float, default=2.0, help='scraper request timeout in seconds')
+    parser.add_argument('--feed-size', type=int, default=50, help='entries per fixture feed')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--per-domain', type=int, default=2)
+    parser.add_argument('--analysis-workers', type=int, default=0, help='0 uses every core')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(scrape_fixture(args.child, args)))
+        return
+
+    articles = list(load_articles(args.cache_file).values())
+    for size in args.sizes:
+        records = corpus(articles, size, args.seed)
+        sources, servers = start_sites(records, args)
+        with tempfile.TemporaryDirectory() as workdir:
+            with open(os.path.join(workdir, 'sources.json'), 'w') as f:
+                json.dump(sources, f)
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), *sys.argv[1:], '--child', workdir],
+                check=True, capture_output=True, text=True,
+            ).stdout
+        for server in servers:
+            server.shutdown()
+        result = {'articles': size, 'sources': len(sources), 'feeds': sum(len(content['rss']) for content in sources.values()),
+                  **json.loads(output.strip().splitlines()[-1])}
+        print(json.dumps(result), flush=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+import pandas as pd
+from sklearn.cluster import AgglomerativeClustering
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import clustering
+from cache import load_articles
+
+# Peak memory of the dense TF-IDF clustering path against the sparse one.
+# Usage: python benchmarks/bench_tfidf_memory.py [--sizes 1000 10000 50000] [--dense-max 5000]
+
+def synthetic_corpus(bodies, size, seed=42):
+    # Resample stored clean bodies, splicing two articles together so documents are not exact copies
+    rng = random.Random(seed)
+    tokenized = [body.split() for body in bodies if body]
+    corpus = []
+    for _ in range(size):
+        first, second = rng.choice(tokenized), rng.choice(tokenized)
+        words = rng.sample(first, int(len(first) * 0.7)) + rng.sample(second, int(len(second) * 0.3))
+        corpus.append(' '.join(words))
+    return pd.DataFrame({'clean_body': corpus})
+
+def dense_path(news_df):
+    tfidf_array = clustering.compute_tfidf(news_df)
+    return AgglomerativeClustering(n_clusters=None, distance_threshold=1.5).fit_predict(tfidf_array)
+
+def sparse_path(news_df):
+    clustering.DENSE_CLUSTER_LIMIT = 0
+    return clustering.cluster_tfidf(clustering.compute_tfidf(news_df, dense=False))
+
+def measure(func, news_df):
+    tracemalloc.start()
+    start = time.perf_counter()
+    labels = func(news_df)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'seconds': round(elapsed, 2), 'peak_mb': round(peak / 2**20, 1), 'clusters': int(len(set(labels)))}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cache-file', default='article_cache.json')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 50000])
+    parser.add_argument('--dense-max', type=int, default=5000, help='largest corpus to run the dense path on')
+    args = parser.parse_args()
+
+    bodies = [article.get('clean_body', '') for article in load_articles(args.cache_file).values()]
+    results = []
+    for size in args.sizes:
+        news_df = synthetic_corpus(bodies, size)
+        vocabulary = len(clustering.TfidfVectorizer().fit(news_df['clean_body']).vocabulary_)
+        result = {
+            'articles': size,
+            'vocabulary': vocabulary,
+            'dense_matrix_mb': round(size * vocabulary * 8 / 2**20, 1),
+            'sparse': measure(sparse_path, news_df),
+        }
+        if size <= args.dense_max:
+            result['dense'] = measure(dense_path, news_df)
+        results.append(result)
+        print(json.dumps(result), flush=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,406 @@
+import gzip
+import json
+import logging
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+CACHE_FILE = 'article_cache.json'
+
+# Compact the journal into a new snapshot once it grows past this size or age
+JOURNAL_MAX_BYTES = int(os.getenv('CACHE_JOURNAL_MAX_BYTES', 4 * 1024 * 1024))
+COMPACT_INTERVAL = int(os.getenv('CACHE_COMPACT_INTERVAL', 3600))
+
+def journal_path(cache_file):
+    base, _ = os.path.splitext(cache_file)
+    return f'{base}.journal'
+
+def read_journal(path):
+    entries = []
+    if not os.path.exists(path):
+        return entries
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A crash mid-append can leave a partial last line behind
+                logging.warning(f'Skipping corrupt journal line in {path}')
+                continue
+            entries.append((record['url'], record['article']))
+    return entries
+
+def load_json_articles(cache_file=CACHE_FILE):
+    # Replay the append-only journal over the last snapshot
+    articles = {}
+    if os.path.exists(cache_file):
+        with open(cache_file, 'r') as f:
+            articles = json.load(f)
+    for url, article in read_journal(journal_path(cache_file)):
+        articles[url] = article
+    return articles
+
+class CacheManager:
+    def __init__(self, cache_file=CACHE_FILE, journal=True, journal_max_bytes=JOURNAL_MAX_BYTES, compact_interval=COMPACT_INTERVAL):
+        self.cache_file = cache_file
+        self.journal = journal
+        self.journal_file = journal_path(cache_file)
+        self.journal_max_bytes = journal_max_bytes
+        self.compact_interval = compact_interval
+        self.load_cache()
+
+    def load_cache(self):
+        logging.info("Loading cache")
+        if os.path.exists(self.cache_file):
+            self.cache = load_json_articles(self.cache_file)
+            self.last_compaction = os.path.getmtime(self.cache_file)
+        else:
+            logging.info("Cache file not found, creating a new one")
+            self.cache = load_json_articles(self.cache_file)
+            self.save_cache()  # Create an empty cache file if it doesn't exist
+        self.journal_bytes = os.path.getsize(self.journal_file) if os.path.exists(self.journal_file) else 0
+        if self.journal_bytes:
+            # Terminate a partial last line so the next append starts on a fresh one
+            with open(self.journal_file, 'rb+') as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    f.write(b'\n')
+
+    def save_cache(self):
+        logging.info("Saving cache")
+        # Write to a temporary file first so readers never see a half-written snapshot
+        tmp_file = f'{self.cache_file}.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(self.cache, f, indent=4)
+        os.replace(tmp_file, self.cache_file)
+        self.last_compaction = time.time()
+
+    def compact(self, force=False):
+        # Nothing to fold in while the journal is empty; removals force a fresh snapshot
+        if not self.journal_bytes and not force:
+            return
+        logging.info("Compacting cache journal into snapshot")
+        self.save_cache()
+        if os.path.exists(self.journal_file):
+            os.remove(self.journal_file)
+        self.journal_bytes = 0
+
+    def needs_compaction(self):
+        if self.journal_bytes == 0:
+            return False
+        return (self.journal_bytes >= self.journal_max_bytes
+                or time.time() - self.last_compaction >= self.compact_interval)
+
+    def get_article(self, url):
+        return self.cache.get(url, None)
+
+    def iter_articles(self):
+        return iter(self.cache.items())
+
+    def expired_urls(self, retention_days, max_articles):
+        return expired_articles(self.cache, retention_days, max_articles)
+
+    def write_entries(self, entries):
+        for url, article_data in entries:
+            self.cache[url] = article_data
+        if not self.journal:
+            self.save_cache()
+            return
+        lines = ''.join(json.dumps({'url': url, 'article': article_data}) + '\n' for url, article_data in entries)
+        with open(self.journal_file, 'a') as f:
+            f.write(lines)
+        self.journal_bytes += len(lines)
+        if self.needs_compaction():
+            self.compact()
+
+    def add_article(self, url, article_data):
+        logging.debug(f'Adding article to cache: {url}')
+        self.write_entries([(url, article_data)])
+
+    def add_articles(self, articles):
+        # Bulk insert keyed by each record's url: one journal append or snapshot write for the batch
+        logging.info(f'Adding {len(articles)} articles to cache')
+        self.write_entries([(article['url'], article) for article in articles])
+
+    def remove_articles(self, urls):
+        # Removals are not journaled; they go straight into a fresh snapshot
+        logging.info(f'Removing {len(urls)} articles from cache')
+        for url in urls:
+            self.cache.pop(url, None)
+        self.compact(force=True)
+
+# SQLite backend: one row per article, with the columns the UI filters on
+# pulled out of the JSON record so they can be indexed
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'json')
+CACHE_DB = os.getenv('CACHE_DB', 'article_cache.db')
+
+INDEXED_COLUMNS = ['source', 'date', 'time', 'title', 'sentiment', 'sentiment_category']
+INSERT_ARTICLE_SQL = (
+    f"INSERT OR REPLACE INTO articles (url, {', '.join(INDEXED_COLUMNS)}, data) "
+    f"VALUES ({', '.join(['?'] * (len(INDEXED_COLUMNS) + 2))})"
+)
+
+def connect_db(db_file=CACHE_DB):
+    conn = sqlite3.connect(db_file)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS articles (
+            url TEXT PRIMARY KEY,
+            source TEXT,
+            date TEXT,
+            time TEXT,
+            title TEXT,
+            sentiment REAL,
+            sentiment_category TEXT,
+            data TEXT NOT NULL
+        )
+    """)
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_articles_date ON articles (date)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_articles_source ON articles (source)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_articles_sentiment ON articles (sentiment_category)')
+    return conn
+
+def article_row(url, article_data):
+    return [url] + [article_data.get(column) for column in INDEXED_COLUMNS] + [json.dumps(article_data)]
+
+class SQLiteCacheManager:
+    def __init__(self, db_file=CACHE_DB):
+        self.db_file = db_file
+        self.load_cache()
+
+    def load_cache(self):
+        logging.info(f"Opening article database {self.db_file}")
+        self.conn = connect_db(self.db_file)
+
+    def save_cache(self):
+        self.conn.commit()
+
+    def compact(self):
+        self.save_cache()
+
+    @property
+    def cache(self):
+        return load_articles(backend='sqlite', db_file=self.db_file)
+
+    def iter_articles(self):
+        # One row decoded at a time, for passes over the store that keep little of it
+        for url, data in self.conn.execute('SELECT url, data FROM articles ORDER BY rowid'):
+            yield url, json.loads(data)
+
+    def expired_urls(self, retention_days, max_articles, today=None):
+        # Same rules as expired_articles, answered from the date index without decoding records
+        cutoff = str((today or date.today()) - timedelta(days=retention_days)) if retention_days else ''
+        expired = set()
+        if retention_days:
+            expired.update(row[0] for row in self.conn.execute("SELECT url FROM articles WHERE date != '' AND date < ?", (cutoff,)))
+        if max_articles:
+            expired.update(row[0] for row in self.conn.execute(
+                "SELECT url FROM articles WHERE NOT (IFNULL(date, '') != '' AND date < ?) "
+                "ORDER BY IFNULL(date, '') DESC, IFNULL(time, '') DESC LIMIT -1 OFFSET ?",
+                (cutoff, max_articles),
+            ))
+        return expired
+
+    def get_article(self, url):
+        row = self.conn.execute('SELECT data FROM articles WHERE url = ?', (url,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def add_article(self, url, article_data):
+        logging.debug(f'Adding article to cache: {url}')
+        self.conn.execute(INSERT_ARTICLE_SQL, article_row(url, article_data))
+        self.conn.commit()
+
+    def add_articles(self, articles):
+        logging.info(f'Adding {len(articles)} articles to cache')
+        with self.conn:
+            self.conn.executemany(INSERT_ARTICLE_SQL, [article_row(article['url'], article) for article in articles])
+
+    def remove_articles(self, urls):
+        logging.info(f'Removing {len(urls)} articles from cache')
+        with self.conn:
+            self.conn.executemany('DELETE FROM articles WHERE url = ?', [(url,) for url in urls])
+
+def load_articles(cache_file=CACHE_FILE, backend=None, db_file=CACHE_DB):
+    if (backend or CACHE_BACKEND) == 'sqlite':
+        conn = connect_db(db_file)
+        try:
+            return {url: json.loads(data) for url, data in conn.execute('SELECT url, data FROM articles ORDER BY rowid')}
+        finally:
+            conn.close()
+    return load_json_articles(cache_file)
+
+def replace_file(path, write):
+    # Derived files are written under a temp name of their own, so concurrent writers
+    # never share one, and swapped in whole. mkstemp creates it private; readers may be
+    # another user.
+    fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+    try:
+        os.chmod(tmp_file, 0o644)
+        with os.fdopen(fd, 'wb') as f:
+            result = write(f)
+        os.replace(tmp_file, path)
+    except BaseException:
+        os.remove(tmp_file)
+        raise
+    return result
+
+def create_cache_manager(backend=None, journal=True):
+    if (backend or CACHE_BACKEND) == 'sqlite':
+        return SQLiteCacheManager()
+    return CacheManager(journal=journal)
+
+def query_articles(start_date=None, end_date=None, sources=None, sentiments=None, backend=None, cache_file=CACHE_FILE, db_file=CACHE_DB):
+    # Filter articles by date range, source and sentiment category. The SQLite
+    # backend answers from its indexes; the JSON backend filters in Python.
+    start_date = str(start_date) if start_date else None
+    end_date = str(end_date) if end_date else None
+    if (backend or CACHE_BACKEND) != 'sqlite':
+        return [
+            article for article in load_json_articles(cache_file).values()
+            if (not start_date or article.get('date', '') >= start_date)
+            and (not end_date or article.get('date', '') <= end_date)
+            and (not sources or article.get('source') in sources)
+            and (not sentiments or article.get('sentiment_category') in sentiments)
+        ]
+
+    clauses, params = [], []
+    if start_date:
+        clauses.append('date >= ?')
+        params.append(start_date)
+    if end_date:
+        clauses.append('date <= ?')
+        params.append(end_date)
+    if sources:
+        clauses.append(f"source IN ({', '.join(['?'] * len(sources))})")
+        params.extend(sources)
+    if sentiments:
+        clauses.append(f"sentiment_category IN ({', '.join(['?'] * len(sentiments))})")
+        params.extend(sentiments)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+    conn = connect_db(db_file)
+    try:
+        rows = conn.execute(f'SELECT data FROM articles {where} ORDER BY rowid', params).fetchall()
+    finally:
+        conn.close()
+    return [json.loads(row[0]) for row in rows]
+
+def article_facets(backend=None, cache_file=CACHE_FILE, db_file=CACHE_DB):
+    # Distinct sources/sentiments, the date range and the article count, for building the sidebar filters
+    if (backend or CACHE_BACKEND) != 'sqlite':
+        articles = list(load_json_articles(cache_file).values())
+        dates = [article['date'] for article in articles if article.get('date')]
+        return {
+            'count': len(articles),
+            'sources': sorted(set(article['source'] for article in articles)),
+            'sentiments': sorted(set(article['sentiment_category'] for article in articles)),
+            'min_date': min(dates) if dates else None,
+            'max_date': max(dates) if dates else None,
+        }
+
+    conn = connect_db(db_file)
+    try:
+        count, min_date, max_date = conn.execute('SELECT COUNT(*), MIN(date), MAX(date) FROM articles').fetchone()
+        sources = [row[0] for row in conn.execute('SELECT DISTINCT source FROM articles ORDER BY source')]
+        sentiments = [row[0] for row in conn.execute('SELECT DISTINCT sentiment_category FROM articles ORDER BY sentiment_category')]
+    finally:
+        conn.close()
+    return {'count': count, 'sources': sources, 'sentiments': sentiments, 'min_date': min_date, 'max_date': max_date}
+
+# Retention: articles older than CACHE_RETENTION_DAYS, or beyond the newest
+# CACHE_RETENTION_MAX_ARTICLES, move out of the live store into one gzipped JSON
+# archive per publication date. 0 disables a limit.
+RETENTION_DAYS = int(os.getenv('CACHE_RETENTION_DAYS', 0))
+RETENTION_MAX_ARTICLES = int(os.getenv('CACHE_RETENTION_MAX_ARTICLES', 0))
+ARCHIVE_DIR = os.getenv('CACHE_ARCHIVE_DIR', 'archive')
+
+def archive_path(archive_date, archive_dir=ARCHIVE_DIR):
+    return os.path.join(archive_dir, f'articles-{archive_date or "undated"}.json.gz')
+
+def read_archive(path):
+    if not os.path.exists(path):
+        return {}
+    with gzip.open(path, 'rt') as f:
+        return json.load(f)
+
+def archived_dates(archive_dir=ARCHIVE_DIR):
+    if not os.path.isdir(archive_dir):
+        return []
+    names = [name[len('articles-'):-len('.json.gz')] for name in os.listdir(archive_dir)
+             if name.startswith('articles-') and name.endswith('.json.gz')]
+    return sorted(name for name in names if name != 'undated')
+
+def expired_articles(articles, retention_days=RETENTION_DAYS, max_articles=RETENTION_MAX_ARTICLES, today=None):
+    expired = set()
+    if retention_days:
+        cutoff = str((today or date.today()) - timedelta(days=retention_days))
+        expired.update(url for url, article in articles.items() if article.get('date') and article['date'] < cutoff)
+    if max_articles and len(articles) - len(expired) > max_articles:
+        newest_first = sorted(
+            (url for url in articles if url not in expired),
+            key=lambda url: (articles[url].get('date') or '', articles[url].get('time') or ''),
+            reverse=True,
+        )
+        expired.update(newest_first[max_articles:])
+    return expired
+
+def archive_articles(articles, archive_dir=ARCHIVE_DIR):
+    # Merge into the existing partition for each date; a rerun after a crash just rewrites the same records
+    os.makedirs(archive_dir, exist_ok=True)
+    by_date = {}
+    for url, article in articles.items():
+        by_date.setdefault(article.get('date'), {})[url] = article
+    for archive_date, partition in by_date.items():
+        path = archive_path(archive_date, archive_dir)
+        merged = read_archive(path)
+        merged.update(partition)
+        tmp_file = f'{path}.tmp'
+        with gzip.open(tmp_file, 'wt') as f:
+            json.dump(merged, f)
+        os.replace(tmp_file, path)
+
+def apply_retention(cache_manager, retention_days=RETENTION_DAYS, max_articles=RETENTION_MAX_ARTICLES, archive_dir=ARCHIVE_DIR):
+    if not (retention_days or max_articles):
+        return 0
+    expired = cache_manager.expired_urls(retention_days, max_articles)
+    if not expired:
+        return 0
+    logging.info(f'Archiving {len(expired)} expired articles to {archive_dir}')
+    # Archive before removing, so an interrupted run never loses articles
+    archive_articles({url: cache_manager.get_article(url) for url in expired}, archive_dir)
+    cache_manager.remove_articles(expired)
+    return len(expired)
+
+def load_archive(start_date=None, end_date=None, archive_dir=ARCHIVE_DIR):
+    # Archived articles published in the date range, opened partition by partition
+    start_date = str(start_date) if start_date else None
+    end_date = str(end_date) if end_date else None
+    articles = {}
+    for archive_date in archived_dates(archive_dir):
+        if (start_date and archive_date < start_date) or (end_date and archive_date > end_date):
+            continue
+        articles.update(read_archive(archive_path(archive_date, archive_dir)))
+    return articles
+
+def migrate_json_to_sqlite(cache_file=CACHE_FILE, db_file=CACHE_DB):
+    logging.info(f"Migrating {cache_file} into {db_file}")
+    articles = load_json_articles(cache_file)
+    conn = connect_db(db_file)
+    with conn:
+        conn.executemany(INSERT_ARTICLE_SQL, [article_row(url, article) for url, article in articles.items()])
+    conn.close()
+    return len(articles)
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'migrate':
+        count = migrate_json_to_sqlite()
+        print(f'Migrated {count} articles from {CACHE_FILE} to {CACHE_DB}')
+    elif len(sys.argv) > 1 and sys.argv[1] == 'archive':
+        count = apply_retention(create_cache_manager())
+        print(f'Archived {count} articles to {ARCHIVE_DIR}')
+    else:
+        print('Usage: python cache.py migrate|archive')
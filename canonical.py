@@ -0,0 +1,164 @@
+import json
+import logging
+import os
+import re
+import sys
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from run_log import summary_path
+
+URL_ALIASES_FILE = os.getenv('URL_ALIASES_FILE', 'url_aliases.json')
+
+# Query parameters that only track where a click came from, dropped for every source.
+# Sources add their own in app/sources.json under "canonical": {"drop_params": [...]}.
+TRACKING_PARAMS = {
+    'fbclid', 'gclid', 'dclid', 'msclkid', 'mc_cid', 'mc_eid', 'ncid', 'cmpid', 'cmp',
+    'guccounter', 'guce_referrer', 'guce_referrer_sig', 'yptr', 'ito', 'at_medium', 'at_campaign',
+}
+TRACKING_PREFIXES = ('utm_',)
+
+# Redirect wrappers that carry the target in a query parameter
+WRAPPER_HOSTS = {'news.google.com', 'google.com', 'l.facebook.com', 'out.reddit.com'}
+WRAPPER_PARAMS = ('url', 'u', 'q')
+
+AMP_SUFFIX = re.compile(r'\.amp(?=\.html?$|$)')
+
+def canonical_url(url, rules=None):
+    # Key for "same article" comparisons only; the original link is what gets downloaded
+    rules = rules or {}
+    drop_params = TRACKING_PARAMS | set(rules.get('drop_params', []))
+    parts = urlsplit(url.strip())
+    host = parts.netloc.lower()
+    if host.startswith('www.'):
+        host = host[4:]
+    params = parse_qsl(parts.query, keep_blank_values=True)
+
+    if host in WRAPPER_HOSTS:
+        for key, value in params:
+            if key in WRAPPER_PARAMS and value.startswith(('http://', 'https://')):
+                return canonical_url(value, rules)
+
+    # AMP variants: /amp/ path segments, a trailing /amp, page.amp.html and ?amp / ?outputType=amp
+    segments = [segment for segment in parts.path.split('/') if segment.lower() != 'amp']
+    path = AMP_SUFFIX.sub('', '/'.join(segments)).rstrip('/') or '/'
+    params = [
+        (key, value) for key, value in params
+        if key.lower() not in drop_params
+        and not key.lower().startswith(TRACKING_PREFIXES)
+        and not (key.lower() == 'amp' or (key.lower() == 'outputtype' and value.lower() == 'amp'))
+    ]
+    # http and https serve the same article, so the scheme is not part of the key
+    return urlunsplit(('https', host, path, urlencode(sorted(params)), ''))
+
+def source_rules(sources):
+    return {source: content.get('canonical', {}) for source, content in sources.items()}
+
+class UrlAliases:
+    # Canonical url -> the url an article is stored under in the cache
+    def __init__(self, aliases_file=URL_ALIASES_FILE):
+        self.aliases_file = aliases_file
+        self.load_state()
+
+    def load_state(self):
+        self.aliases = {}
+        if os.path.exists(self.aliases_file):
+            logging.info("Loading URL aliases")
+            with open(self.aliases_file, 'r') as f:
+                self.aliases = json.load(f)
+
+    def save_state(self):
+        logging.info("Saving URL aliases")
+        tmp_file = f'{self.aliases_file}.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(self.aliases, f)
+        os.replace(tmp_file, self.aliases_file)
+
+    def get(self, canonical):
+        return self.aliases.get(canonical)
+
+    def add(self, canonical, cache_key):
+        self.aliases.setdefault(canonical, cache_key)
+
+    def seed(self, articles, rules_by_source):
+        # Map the (url, article) pairs already in the store, for a first run with an empty alias map
+        for url, article in articles:
+            self.add(canonical_url(url, rules_by_source.get(article.get('source'))), url)
+
+# The per-article lookup lines, logged at DEBUG since run summaries replaced them
+LOOKUP_LINE = re.compile(r' - [A-Z]+ - (Using cached article|Processing article|Adding article to cache): (.*)$')
+
+def replay_log(log_file, rules_by_source):
+    # Re-run the cache lookups recorded in a scraper log with canonical keys. A download
+    # counts as an alias hit when its canonical url, but not the link itself, was stored
+    # earlier. Log lines do not say which source a link came from, so every source's rules apply.
+    # Needs a log written with LOG_LEVEL=DEBUG, or one from before the run summaries.
+    rules = {'drop_params': [param for source_rules in rules_by_source.values() for param in source_rules.get('drop_params', [])]}
+    stored_links, stored_canonical = set(), set()
+    seen_links, seen_canonical = set(), set()
+    cache_hits = downloads = repeat_downloads = alias_hits = 0
+    with open(log_file, 'r', errors='replace') as f:
+        for line in f:
+            match = LOOKUP_LINE.search(line)
+            if not match:
+                continue
+            message, link = match.group(1), match.group(2).strip()
+            if message == 'Using cached article':
+                cache_hits += 1
+            elif message == 'Processing article':
+                downloads += 1
+                canonical = canonical_url(link, rules)
+                seen_links.add(link)
+                seen_canonical.add(canonical)
+                if link in stored_links:
+                    repeat_downloads += 1  # the raw key would have hit too, had the cache been kept
+                elif canonical in stored_canonical:
+                    alias_hits += 1
+            else:
+                stored_links.add(link)
+                stored_canonical.add(canonical_url(link, rules))
+    lookups = cache_hits + downloads
+    return {
+        'lookups': lookups,
+        'cache_hits': cache_hits,
+        'repeat_downloads': repeat_downloads,
+        'alias_hits': alias_hits,
+        'distinct_links': len(seen_links),
+        'distinct_canonical_urls': len(seen_canonical),
+        'raw_hit_rate': cache_hits / lookups if lookups else 0.0,
+        'canonical_hit_rate': (cache_hits + alias_hits) / lookups if lookups else 0.0,
+    }
+
+def summarize_runs(summary_file):
+    # Hit rates as the scraper measured them, from the counters in its run summaries.
+    # Alias hits are cache hits found only through a canonical url.
+    cache_hits = downloads = alias_hits = runs = 0
+    with open(summary_file, 'r') as f:
+        for line in f:
+            run = json.loads(line)
+            runs += 1
+            cache_hits += run.get('cache_hits', 0)
+            downloads += run.get('downloads', 0)
+            alias_hits += run.get('alias_hits', 0)
+    lookups = cache_hits + downloads
+    return {
+        'runs': runs,
+        'lookups': lookups,
+        'cache_hits': cache_hits,
+        'alias_hits': alias_hits,
+        'downloads': downloads,
+        'raw_hit_rate': (cache_hits - alias_hits) / lookups if lookups else 0.0,
+        'canonical_hit_rate': cache_hits / lookups if lookups else 0.0,
+    }
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'report':
+        with open('app/sources.json', 'r') as f:
+            rules_by_source = source_rules(json.load(f))
+        log_file = sys.argv[2] if len(sys.argv) > 2 else 'scrapper.log'
+        report = replay_log(log_file, rules_by_source)
+        # Logs at the default level carry no lookup lines; the run summaries have the counts
+        if not report['lookups'] and os.path.exists(summary_path(log_file)):
+            report = summarize_runs(summary_path(log_file))
+        print(json.dumps(report, indent=4))
+    else:
+        print('Usage: python canonical.py report [scrapper.log]')
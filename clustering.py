@@ -1,13 +1,37 @@
 import pandas as pd
 import numpy as np
+import scipy.sparse as sp
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.cluster import AgglomerativeClustering
 import json
 import logging
+import os
+import sys
+from collections import Counter
+from datetime import datetime, timezone
+from sklearn.decomposition import TruncatedSVD
+from sklearn.neighbors import kneighbors_graph
+from sklearn.preprocessing import normalize
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.cluster import KMeans
+from cache import load_articles
+from features import load_features
+from run_log import RunSummary, setup_logging, start_profiling, summary_path, timed
 
 CACHE_FILE = 'article_cache.json'
+LOG_FILE = os.getenv('CLUSTERING_LOG_FILE', 'clustering.log')
+
+# Precomputed article -> cluster mapping read by the Streamlit pages; bump the
+# version when its layout changes so stale files are ignored
+CLUSTER_INDEX_FILE = os.getenv('CLUSTER_INDEX_FILE', 'cluster_index.json')
+CLUSTER_INDEX_VERSION = 1
+
+# Above this many articles clustering switches from the dense TF-IDF matrix to the sparse path
+DENSE_CLUSTER_LIMIT = int(os.getenv('DENSE_CLUSTER_LIMIT', 2000))
+# ...or when the dense matrix would hold more cells than this (25M float64 cells is 200 MB)
+DENSE_CLUSTER_MAX_CELLS = int(os.getenv('DENSE_CLUSTER_MAX_CELLS', 25_000_000))
+SVD_COMPONENTS = int(os.getenv('TFIDF_SVD_COMPONENTS', 200))
+CLUSTER_NEIGHBORS = int(os.getenv('CLUSTER_NEIGHBORS', 15))
 
 class Helper:
     @staticmethod
@@ -24,12 +48,47 @@ class Helper:
         news_df = news_df[news_df.body.str.count(r'\s+').ge(20)]
         return news_df
 
-def compute_tfidf(news_df):
+def compute_tfidf(news_df, dense=True):
     logging.info("Computing TF-IDF values")
-    tfidf_matrix = TfidfVectorizer().fit_transform(news_df['clean_body'])
+    with timed('compute_tfidf'):
+        features = load_features('clean_body') if 'url' in news_df.columns else None
+        if features is not None:
+            # Stored vectors; only articles newer than the store are vectorized here
+            tfidf_matrix = features.tfidf(news_df['url'], news_df['clean_body'])
+        else:
+            tfidf_matrix = TfidfVectorizer().fit_transform(news_df['clean_body'])
+    if not dense:
+        return tfidf_matrix
     tfidf_array = np.asarray(tfidf_matrix.todense())
     return tfidf_array
 
+def reduce_tfidf(tfidf_matrix, n_components=SVD_COMPONENTS):
+    # Project the sparse matrix onto its top singular vectors and re-normalize,
+    # so distances stay on the same scale as the unit-length TF-IDF rows
+    n_components = max(1, min(n_components, tfidf_matrix.shape[0] - 1, tfidf_matrix.shape[1] - 1))
+    svd = TruncatedSVD(n_components=n_components, random_state=42)
+    return normalize(svd.fit_transform(tfidf_matrix))
+
+def cluster_tfidf(tfidf_matrix, distance_threshold=1.5):
+    # Small corpora keep the exact dense clustering. Larger ones never densify the
+    # TF-IDF matrix: they cluster SVD-reduced vectors under a k-nearest-neighbour
+    # connectivity graph, which keeps memory linear in the number of articles.
+    n_articles = tfidf_matrix.shape[0]
+    if n_articles < 2:
+        return np.zeros(n_articles, dtype=int)
+    with timed('cluster_fit'):
+        # Columns no article uses do not change any distance; hashed vectors are 2**18 wide
+        tfidf_matrix = sp.csr_matrix(tfidf_matrix)
+        tfidf_matrix = tfidf_matrix[:, np.flatnonzero(tfidf_matrix.getnnz(axis=0))]
+        if n_articles <= DENSE_CLUSTER_LIMIT and n_articles * tfidf_matrix.shape[1] <= DENSE_CLUSTER_MAX_CELLS:
+            clustering_model = AgglomerativeClustering(n_clusters=None, distance_threshold=distance_threshold)
+            return clustering_model.fit_predict(tfidf_matrix.toarray())
+
+        reduced = reduce_tfidf(tfidf_matrix)
+        connectivity = kneighbors_graph(reduced, n_neighbors=min(CLUSTER_NEIGHBORS, n_articles - 1), include_self=False)
+        clustering_model = AgglomerativeClustering(n_clusters=None, distance_threshold=distance_threshold, connectivity=connectivity)
+        return clustering_model.fit_predict(reduced)
+
 def find_featured_clusters(clusters):
     logging.info("Finding clusters with articles from multiple sources")
     featured_clusters = {}
@@ -38,34 +97,87 @@ def find_featured_clusters(clusters):
             featured_clusters[i] = clusters[i]
     return featured_clusters
 
-def main():
-    logging.info("Loading articles from cache")
-    with open(CACHE_FILE, 'r') as f:
-        articles = json.load(f)
-    
-    news_df = pd.DataFrame(articles.values())
-    helper = Helper()
-    news_df = helper.clean_dataframe(news_df)
-    tfidf_array = compute_tfidf(news_df)
-    
-    clustering_model = AgglomerativeClustering(n_clusters=None, distance_threshold=1.5)
-    news_df['cluster_id'] = clustering_model.fit_predict(tfidf_array)
-    
-    clusters = {str(cluster_id): news_df[news_df.cluster_id == cluster_id].to_dict(orient='records')
-                for cluster_id in np.unique(news_df.cluster_id)}
+def build_cluster_index(clusters, featured_clusters, top_keywords=5):
+    index_clusters = {}
+    for cluster_id, members in clusters.items():
+        keywords = Counter(keyword for article in members for keyword in (article.get('keywords') or []))
+        index_clusters[cluster_id] = {
+            'members': [article['url'] for article in members],
+            'sources': sorted(set(article['source'] for article in members)),
+            'featured': cluster_id in featured_clusters,
+            'keywords': [keyword for keyword, _ in keywords.most_common(top_keywords)],
+        }
+    return {
+        'version': CLUSTER_INDEX_VERSION,
+        'generated_at': datetime.now(timezone.utc).isoformat(),
+        'articles': {url: cluster_id for cluster_id, cluster in index_clusters.items() for url in cluster['members']},
+        'clusters': index_clusters,
+    }
+
+def save_cluster_index(index, index_file=CLUSTER_INDEX_FILE):
+    logging.info("Saving cluster index")
+    tmp_file = f'{index_file}.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(index, f)
+    os.replace(tmp_file, index_file)
+
+def load_cluster_index(index_file=CLUSTER_INDEX_FILE):
+    # None when clustering.py has not produced an index in the current format yet
+    if not os.path.exists(index_file):
+        return None
+    with open(index_file, 'r') as f:
+        index = json.load(f)
+    if index.get('version') != CLUSTER_INDEX_VERSION:
+        logging.warning(f'Ignoring cluster index with version {index.get("version")}')
+        return None
+    return index
+
+def main(run=None):
+    run = (run or RunSummary()).activate()
+    with run.stage('load'):
+        logging.info("Loading articles from cache")
+        articles = load_articles(CACHE_FILE)
+        
+        news_df = pd.DataFrame(articles.values())
+        helper = Helper()
+        news_df = helper.clean_dataframe(news_df)
+    run.count('articles', len(news_df))
+    # Imported here because story_clusters builds on this module
+    from story_clusters import StoryClusterer
     
-    featured_clusters = find_featured_clusters(clusters)
+    # New articles join the nearest existing story; a full re-cluster runs when due or with --full
+    with run.stage('story_clusters'):
+        story_clusterer = StoryClusterer()
+        story_clusterer.update(news_df['url'].tolist(), news_df['clean_body'].tolist(), full='--full' in sys.argv)
+        story_clusterer.save_state()
+        news_df['cluster_id'] = story_clusterer.labels_for(news_df['url'])
     
-    logging.info("Saving clusters to cache")
-    with open(CACHE_FILE, 'w') as f:
-        json.dump(articles, f, indent=4)
+    with run.stage('cluster_index'):
+        clusters = {str(cluster_id): news_df[news_df.cluster_id == cluster_id].to_dict(orient='records')
+                    for cluster_id in np.unique(news_df.cluster_id)}
+        
+        featured_clusters = find_featured_clusters(clusters)
+        
+        save_cluster_index(build_cluster_index(clusters, featured_clusters))
+    run.count('clusters', len(clusters))
+    run.count('featured_clusters', len(featured_clusters))
 
 if __name__ == "__main__":
-    main()
+    setup_logging(LOG_FILE)
+    profiler = start_profiling(LOG_FILE)
+    run = RunSummary()
+    main(run)
+    run.write(summary_path(LOG_FILE))
+    if profiler:
+        profiler.stop()
 
-def cluster_articles(titles, n_clusters=5):
-    vectorizer = TfidfVectorizer(stop_words='english')
-    X = vectorizer.fit_transform(titles)
+def cluster_articles(titles, n_clusters=5, urls=None):
+    features = load_features('title') if urls is not None else None
+    if features is not None:
+        X = features.tfidf(urls, titles)
+    else:
+        vectorizer = TfidfVectorizer(stop_words='english')
+        X = vectorizer.fit_transform(titles)
 
     kmeans = KMeans(n_clusters=n_clusters, random_state=42)
     kmeans.fit(X)
@@ -0,0 +1,100 @@
+import calendar
+import logging
+import re
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+import dateutil.parser
+
+# Timezone abbreviations feeds put in their dates, which strptime and dateutil cannot resolve alone
+TIMEZONES = {
+    'GMT': timezone.utc,
+    'UTC': timezone.utc,
+    'UT': timezone.utc,
+    'Z': timezone.utc,
+    'EDT': timezone(timedelta(hours=-4)),
+    'EST': timezone(timedelta(hours=-5)),
+    'CDT': timezone(timedelta(hours=-5)),
+    'CST': timezone(timedelta(hours=-6)),
+    'MDT': timezone(timedelta(hours=-6)),
+    'MST': timezone(timedelta(hours=-7)),
+    'PDT': timezone(timedelta(hours=-7)),
+    'PST': timezone(timedelta(hours=-8)),
+}
+
+# Formats tried, in order, for dates feedparser could not turn into a time struct
+DATE_FORMATS = (
+    '%a, %d %b %Y %H:%M:%S %z',
+    '%a, %d %b %Y %H:%M %z',
+    '%d %b %Y %H:%M:%S %z',
+    '%a, %d %B %Y %H:%M:%S %z',
+    '%Y-%m-%dT%H:%M:%S%z',
+    '%Y-%m-%dT%H:%M:%S.%f%z',
+    '%Y-%m-%d %H:%M:%S%z',
+    '%Y-%m-%dT%H:%M:%S',
+    '%Y-%m-%d %H:%M:%S',
+    '%Y-%m-%d',
+)
+
+TIMEZONE_SUFFIX = re.compile(r'\s*\b([A-Z]{1,4})$')
+
+PATHS = ('struct', 'format', 'dateutil', 'failed')
+
+def with_offset(value):
+    # "... 10:00:00 EDT" -> "... 10:00:00 -0400", so %z can read it
+    match = TIMEZONE_SUFFIX.search(value)
+    if match and match.group(1) in TIMEZONES:
+        offset = TIMEZONES[match.group(1)].utcoffset(None)
+        minutes = int(offset.total_seconds()) // 60
+        sign = '-' if minutes < 0 else '+'
+        value = f'{value[:match.start()]} {sign}{abs(minutes) // 60:02d}{abs(minutes) % 60:02d}'
+    return value
+
+def as_utc(date):
+    # Dates without a zone are taken as UTC
+    if date.tzinfo is None:
+        return date.replace(tzinfo=timezone.utc)
+    return date.astimezone(timezone.utc)
+
+class DateNormalizer:
+    # Publish time of a feed entry as an aware UTC datetime. feedparser's own parsed struct
+    # is used when it has one; otherwise the format that last worked for the feed, then
+    # the known formats, and dateutil only as a last resort. stats counts each path.
+    def __init__(self):
+        self.feed_formats = {}  # feed url -> format that parsed its last date
+        self.stats = Counter()
+
+    def has_date(self, entry):
+        return any(entry.get(field) for field in ('published_parsed', 'updated_parsed', 'published', 'updated'))
+
+    def parse_entry(self, entry, feed_url=None):
+        for field in ('published_parsed', 'updated_parsed'):
+            parsed = entry.get(field)
+            if parsed:
+                self.stats['struct'] += 1
+                # feedparser normalizes the struct to UTC
+                return datetime.fromtimestamp(calendar.timegm(parsed), timezone.utc)
+        value = entry.get('published') or entry.get('updated')
+        if not value:
+            self.stats['failed'] += 1
+            return None
+        return self.parse(value, feed_url)
+
+    def parse(self, value, feed_url=None):
+        value = with_offset(value.strip())
+        known = self.feed_formats.get(feed_url)
+        for date_format in ([known] if known else []) + [f for f in DATE_FORMATS if f != known]:
+            try:
+                date = datetime.strptime(value, date_format)
+            except ValueError:
+                continue
+            self.feed_formats[feed_url] = date_format
+            self.stats['format'] += 1
+            return as_utc(date)
+        try:
+            date = dateutil.parser.parse(value, tzinfos=TIMEZONES)
+        except (ValueError, OverflowError) as e:
+            logging.error(f'Error parsing article date "{value}": {e}')
+            self.stats['failed'] += 1
+            return None
+        self.stats['dateutil'] += 1
+        return as_utc(date)
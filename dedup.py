@@ -0,0 +1,148 @@
+import logging
+import os
+import re
+import zlib
+import numpy as np
+
+from cache import create_cache_manager
+
+DEDUP_INDEX_FILE = os.getenv('DEDUP_INDEX_FILE', 'dedup_index.npz')
+
+# Estimated Jaccard similarity of body shingles above which an article counts as a copy
+DUPLICATE_THRESHOLD = float(os.getenv('DUPLICATE_THRESHOLD', 0.8))
+
+# MinHash over word 5-gram shingles, bucketed by LSH into 16 bands of 4 rows, so pairs
+# from about 0.5 similarity up become candidates and are then checked against the threshold
+SHINGLE_SIZE = 5
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+
+# Boilerplate bodies (paywalls, risk disclaimers) match each other while the stories differ,
+# so a copy must also share most of its headline words with the original
+TITLE_SIMILARITY = float(os.getenv('DUPLICATE_TITLE_SIMILARITY', 0.5))
+
+# Too short to shingle meaningfully
+MIN_TOKENS = 50
+
+TOKEN_PATTERN = re.compile(r'\w+')
+
+MERSENNE_PRIME = (1 << 31) - 1
+random_state = np.random.RandomState(1)
+PERM_A = random_state.randint(1, MERSENNE_PRIME, size=NUM_PERM).astype(np.uint64)
+PERM_B = random_state.randint(0, MERSENNE_PRIME, size=NUM_PERM).astype(np.uint64)
+
+def title_words(title):
+    return frozenset(TOKEN_PATTERN.findall((title or '').lower()))
+
+def minhash(text):
+    tokens = TOKEN_PATTERN.findall((text or '').lower())
+    if len(tokens) < MIN_TOKENS:
+        return None
+    # crc32 rather than hash() so signatures stay comparable across runs
+    shingles = {zlib.crc32(' '.join(tokens[i:i + SHINGLE_SIZE]).encode()) for i in range(len(tokens) - SHINGLE_SIZE + 1)}
+    hashes = np.fromiter(shingles, dtype=np.uint64, count=len(shingles)) & MERSENNE_PRIME
+    return ((PERM_A[:, None] * hashes[None, :] + PERM_B[:, None]) % MERSENNE_PRIME).min(axis=1).astype(np.uint32)
+
+class DuplicateIndex:
+    # Signatures of the distinct articles seen so far, persisted between runs.
+    # Copies are not added, so every bucket points at the first version of a story.
+    def __init__(self, index_file=DEDUP_INDEX_FILE, threshold=DUPLICATE_THRESHOLD):
+        self.index_file = index_file
+        self.threshold = threshold
+        self.load_state()
+
+    def clear(self):
+        self.urls = []
+        self.titles = []
+        self.signatures = []
+        self.buckets = {}
+
+    def load_state(self):
+        self.clear()
+        if not os.path.exists(self.index_file):
+            return
+        logging.info("Loading duplicate index")
+        with np.load(self.index_file) as state:
+            for url, title, signature in zip(state['urls'].tolist(), state['titles'].tolist(), state['signatures']):
+                self.add(url, title, signature)
+
+    def save_state(self):
+        logging.info("Saving duplicate index")
+        signatures = np.array(self.signatures, dtype=np.uint32).reshape(-1, NUM_PERM)
+        tmp_file = f'{self.index_file}.tmp.npz'
+        np.savez(tmp_file, urls=np.array(self.urls, dtype=str), titles=np.array(self.titles, dtype=str), signatures=signatures)
+        os.replace(tmp_file, self.index_file)
+
+    def band_keys(self, signature):
+        return [(band, signature[band * ROWS:(band + 1) * ROWS].tobytes()) for band in range(BANDS)]
+
+    def add(self, url, title, signature):
+        doc_id = len(self.urls)
+        self.urls.append(url)
+        self.titles.append(title or '')
+        self.signatures.append(signature)
+        for key in self.band_keys(signature):
+            self.buckets.setdefault(key, []).append(doc_id)
+
+    def find(self, title, signature):
+        # Best candidate sharing a band, if its estimated similarity clears the threshold
+        candidates = {doc_id for key in self.band_keys(signature) for doc_id in self.buckets.get(key, ())}
+        words = title_words(title)
+        best_url, best_similarity = None, self.threshold
+        for doc_id in candidates:
+            candidate_words = title_words(self.titles[doc_id])
+            if len(words & candidate_words) < TITLE_SIMILARITY * len(words | candidate_words):
+                continue
+            similarity = np.mean(self.signatures[doc_id] == signature)
+            if similarity >= best_similarity:
+                best_url, best_similarity = self.urls[doc_id], similarity
+        return best_url
+
+    def check(self, url, title, text):
+        # The url of the article this one copies, or None after registering it as a new original
+        signature = minhash(text)
+        if signature is None:
+            return None
+        original = self.find(title, signature)
+        if original is None or original == url:
+            if original is None:
+                self.add(url, title, signature)
+            return None
+        return original
+
+    def seed(self, articles):
+        # Index the (url, article) pairs already in the store, oldest first, for a first run
+        # with an empty index. Known copies are skipped; flagging new ones is `python dedup.py`.
+        entries = []
+        for url, article in articles:
+            signature = minhash(article.get('body'))
+            if signature is not None and not isinstance(article.get('duplicate_of'), str):
+                entries.append(((article.get('date') or '', article.get('time') or ''), url, article.get('title'), signature))
+        for _, url, title, signature in sorted(entries, key=lambda entry: entry[0]):
+            if self.find(title, signature) is None:
+                self.add(url, title, signature)
+        logging.info(f'Seeded the duplicate index with {len(self.urls)} articles')
+
+def mark_duplicates(articles, index):
+    # Index existing articles oldest first, returning the copies with duplicate_of set
+    duplicates = []
+    ordered = sorted(articles.items(), key=lambda item: (item[1].get('date') or '', item[1].get('time') or ''))
+    for url, article in ordered:
+        original = index.check(url, article.get('title'), article.get('body'))
+        if original and article.get('duplicate_of') != original:
+            duplicates.append({**article, 'duplicate_of': original})
+    return duplicates
+
+if __name__ == '__main__':
+    # Rebuild the index from the article store and flag the copies already in it
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    cache_manager = create_cache_manager()
+    index = DuplicateIndex()
+    index.clear()
+    duplicates = mark_duplicates(cache_manager.cache, index)
+    if duplicates:
+        cache_manager.add_articles(duplicates)
+        cache_manager.compact()
+    index.save_state()
+    print(f'Indexed {len(index.urls)} distinct articles, flagged {len(duplicates)} duplicates')
@@ -6,5 +6,11 @@ python scrapper.py
 echo "Running the clustering script..."
 python clustering.py
 
+# SCRAPER_DAEMON=1 keeps polling the feeds in the background, each on its own schedule
+if [ "$SCRAPER_DAEMON" = "1" ]; then
+    echo "Starting the scrapper daemon..."
+    python scrapper.py --daemon &
+fi
+
 echo "Starting the Streamlit app..."
 exec streamlit run main.py "$@"
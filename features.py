@@ -0,0 +1,224 @@
+import logging
+import os
+import zlib
+from collections import Counter
+import numpy as np
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import CountVectorizer, HashingVectorizer
+from sklearn.preprocessing import normalize
+
+from cache import load_articles
+
+# Term counts per article, persisted so clustering and similarity queries start from stored
+# vectors instead of re-tokenizing the corpus. Raw counts and document frequencies are kept
+# and IDF is applied when vectors are read, so adding articles never rewrites the old rows.
+FEATURE_STORE = os.getenv('FEATURE_STORE', '1') == '1'
+FEATURE_STORE_FILE = os.getenv('FEATURE_STORE_FILE', 'features_{field}.npz')
+
+# Hashing mode has no vocabulary to grow or persist; columns are hash buckets
+FEATURE_HASHING = os.getenv('FEATURE_HASHING', '0') == '1'
+HASHING_FEATURES = 2 ** 18
+
+# Bump when the stored layout or the tokenization changes so stores are rebuilt
+FEATURE_STORE_VERSION = 1
+
+# Tokenization per field, matching the TfidfVectorizer each consumer fitted before
+FIELD_SETTINGS = {
+    'clean_body': {},
+    'title': {'stop_words': 'english'},
+}
+
+def text_hash(text):
+    return zlib.crc32(text.encode())
+
+def pack_strings(strings):
+    return np.frombuffer('\n'.join(strings).encode(), dtype=np.uint8)
+
+def unpack_strings(packed):
+    text = packed.tobytes().decode()
+    return text.split('\n') if text else []
+
+class FeatureStore:
+    def __init__(self, field, store_file=None, hashing=FEATURE_HASHING):
+        self.field = field
+        self.store_file = store_file or FEATURE_STORE_FILE.format(field=field)
+        self.hashing = hashing
+        settings = FIELD_SETTINGS.get(field, {})
+        self.analyzer = CountVectorizer(**settings).build_analyzer()
+        self.hasher = HashingVectorizer(n_features=HASHING_FEATURES, alternate_sign=False, norm=None, **settings)
+        self.load_state()
+
+    def clear(self):
+        self.corpus_version = 0
+        self.urls = []  # row -> url, None once the row is replaced or removed
+        self.rows = {}  # url -> row
+        self.hashes = []  # row -> hash of the text its counts came from
+        self.terms = []  # column -> term, vocabulary mode only
+        self.vocabulary = {}
+        self.df = np.zeros(self.n_columns(), dtype=np.int64)
+        self.counts = sp.csr_matrix((0, self.n_columns()), dtype=np.float64)
+
+    def n_columns(self):
+        return HASHING_FEATURES if self.hashing else len(self.terms)
+
+    def load_state(self):
+        self.clear()
+        if not os.path.exists(self.store_file):
+            return
+        with np.load(self.store_file) as state:
+            if int(state['version']) != FEATURE_STORE_VERSION or bool(state['hashing']) != self.hashing:
+                logging.info(f'Feature store {self.store_file} is outdated, rebuilding')
+                return
+            logging.info(f'Loading feature store {self.store_file}')
+            self.corpus_version = int(state['corpus_version'])
+            self.urls = unpack_strings(state['urls'])
+            self.rows = {url: row for row, url in enumerate(self.urls)}
+            self.hashes = state['hashes'].tolist()
+            self.terms = unpack_strings(state['terms'])
+            self.vocabulary = {term: column for column, term in enumerate(self.terms)}
+            self.df = state['df']
+            self.counts = sp.csr_matrix((state['data'], state['indices'], state['indptr']), shape=tuple(state['shape']))
+
+    def save_state(self):
+        self.compact()
+        logging.info(f'Saving feature store {self.store_file}')
+        tmp_file = f'{self.store_file}.tmp.npz'
+        np.savez(
+            tmp_file,
+            version=FEATURE_STORE_VERSION,
+            hashing=self.hashing,
+            corpus_version=self.corpus_version,
+            urls=pack_strings(self.urls),
+            hashes=np.array(self.hashes, dtype=np.uint32),
+            terms=pack_strings(self.terms),
+            df=self.df,
+            data=self.counts.data,
+            indices=self.counts.indices,
+            indptr=self.counts.indptr,
+            shape=np.array(self.counts.shape),
+        )
+        os.replace(tmp_file, self.store_file)
+
+    def compact(self):
+        # Drop the rows of replaced and removed articles
+        alive = [row for row, url in enumerate(self.urls) if url is not None]
+        if len(alive) == len(self.urls):
+            return
+        self.counts = self.counts[alive]
+        self.urls = [self.urls[row] for row in alive]
+        self.hashes = [self.hashes[row] for row in alive]
+        self.rows = {url: row for row, url in enumerate(self.urls)}
+
+    def count_vectors(self, texts, grow=False):
+        # Raw term counts. Terms outside the vocabulary get a new column when growing it,
+        # otherwise they are ignored, as TfidfVectorizer.transform would.
+        if self.hashing:
+            return self.hasher.transform(texts).astype(np.float64)
+        indptr, indices, data = [0], [], []
+        for text in texts:
+            for term, count in Counter(self.analyzer(text)).items():
+                column = self.vocabulary.get(term)
+                if column is None:
+                    if not grow:
+                        continue
+                    column = self.vocabulary[term] = len(self.terms)
+                    self.terms.append(term)
+                indices.append(column)
+                data.append(count)
+            indptr.append(len(indices))
+        return sp.csr_matrix((np.array(data, dtype=np.float64), np.array(indices, dtype=np.int32), indptr),
+                             shape=(len(texts), self.n_columns()))
+
+    def remove(self, url):
+        row = self.rows.pop(url)
+        self.urls[row] = None
+        self.df[self.counts[row].indices] -= 1
+
+    def update(self, texts_by_url):
+        # Make the store match the given articles: new and changed texts are counted,
+        # articles no longer present are dropped. Returns the number of rows written.
+        for url in [url for url in self.rows if url not in texts_by_url]:
+            self.remove(url)
+        changed = [(url, text or '') for url, text in texts_by_url.items()
+                   if url not in self.rows or self.hashes[self.rows[url]] != text_hash(text or '')]
+        if not changed:
+            return 0
+        for url, _ in changed:
+            if url in self.rows:
+                self.remove(url)
+        new_counts = self.count_vectors([text for _, text in changed], grow=True)
+        self.counts.resize((self.counts.shape[0], self.n_columns()))
+        self.counts = sp.vstack([self.counts, new_counts], format='csr')
+        self.df = np.concatenate([self.df, np.zeros(self.n_columns() - len(self.df), dtype=np.int64)])
+        self.df += np.bincount(new_counts.indices, minlength=self.n_columns())
+        for url, text in changed:
+            self.rows[url] = len(self.urls)
+            self.urls.append(url)
+            self.hashes.append(text_hash(text))
+        self.corpus_version += 1
+        return len(changed)
+
+    def idf(self):
+        # Smoothed IDF over the stored articles, the TfidfVectorizer default
+        return np.log((1 + len(self.rows)) / (1 + self.df)) + 1
+
+    def select(self, urls, texts=None):
+        # Count rows in the order of urls; articles not stored are counted from their text
+        urls = list(urls)
+        texts = list(texts) if texts is not None else [None] * len(urls)
+        stored = [i for i, url in enumerate(urls) if url in self.rows]
+        missing = [i for i, url in enumerate(urls) if url not in self.rows]
+        if missing and any(texts[i] is None for i in missing):
+            raise KeyError(f'{len(missing)} articles are not in the {self.field} feature store')
+        parts = [self.counts[[self.rows[urls[i]] for i in stored]]]
+        if missing:
+            parts.append(self.count_vectors([texts[i] or '' for i in missing]))
+        order = np.argsort(np.array(stored + missing, dtype=np.int64), kind='stable')
+        return sp.vstack(parts, format='csr')[order]
+
+    def tfidf(self, urls, texts=None):
+        # L2-normalized TF-IDF rows, with the columns none of them use dropped so the
+        # matrix is only as wide as this subset's vocabulary
+        matrix = normalize(self.select(urls, texts) @ sp.diags(self.idf()))
+        return matrix[:, np.flatnonzero(matrix.getnnz(axis=0))]
+
+    def term_vectors(self, urls, texts=None):
+        # L2-normalized counts without IDF, the vectors story_clusters clusters on
+        return normalize(self.select(urls, texts))
+
+def build_feature_stores(articles, hashing=FEATURE_HASHING):
+    # articles are (url, article) pairs, read once for all fields
+    texts = {field: {} for field in FIELD_SETTINGS}
+    for url, article in articles:
+        for field in FIELD_SETTINGS:
+            texts[field][url] = article.get(field) or ''
+    for field in FIELD_SETTINGS:
+        store = FeatureStore(field, hashing=hashing)
+        written = store.update(texts[field])
+        logging.info(f'Feature store for {field}: {written} articles vectorized, {len(store.rows)} stored')
+        store.save_state()
+
+loaded_stores = {}  # field -> (modification time, store)
+
+def load_features(field):
+    # The saved store for field, reloaded when the scraper rewrites it; None when there is none
+    if not FEATURE_STORE:
+        return None
+    store_file = FEATURE_STORE_FILE.format(field=field)
+    if not os.path.exists(store_file):
+        return None
+    mtime = os.path.getmtime(store_file)
+    if field not in loaded_stores or loaded_stores[field][0] != mtime:
+        loaded_stores[field] = (mtime, FeatureStore(field, store_file))
+    store = loaded_stores[field][1]
+    # Empty when it was written in the other mode or an older layout
+    return store if store.rows else None
+
+if __name__ == '__main__':
+    # Rebuild the stores from the article store
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    for field in FIELD_SETTINGS:
+        store_file = FEATURE_STORE_FILE.format(field=field)
+        if os.path.exists(store_file):
+            os.remove(store_file)
+    build_feature_stores(load_articles().items())
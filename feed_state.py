@@ -0,0 +1,55 @@
+import hashlib
+import json
+import logging
+import os
+
+FEED_STATE_FILE = os.getenv('FEED_STATE_FILE', 'feed_state.json')
+
+def entry_key(entry_id):
+    # Short digest of an entry's guid (or link), enough to tell a feed's entries apart
+    return hashlib.sha1(entry_id.encode()).hexdigest()[:16]
+
+# Per-feed state persisted between scraper runs, keyed by feed URL: HTTP validators
+# and the entries already handled (entry key -> publish timestamp)
+class FeedState:
+    def __init__(self, state_file=FEED_STATE_FILE):
+        self.state_file = state_file
+        self.load_state()
+
+    def load_state(self):
+        logging.info("Loading feed state")
+        self.state = {}
+        if os.path.exists(self.state_file):
+            try:
+                with open(self.state_file, 'r') as f:
+                    self.state = json.load(f)
+            except ValueError as e:
+                logging.error(f'Error reading feed state, starting fresh: {e}')
+
+    def save_state(self):
+        logging.info("Saving feed state")
+        tmp_file = f'{self.state_file}.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(self.state, f, indent=4)
+        os.replace(tmp_file, self.state_file)
+
+    def get_feed(self, url):
+        return self.state.get(url, {})
+
+    def update_feed(self, url, **values):
+        self.state.setdefault(url, {}).update(values)
+
+    def seen_entries(self, url):
+        return self.state.get(url, {}).get('seen', {})
+
+    def set_seen(self, url, seen):
+        # Replaces the whole set, so entries that dropped out of the feed are forgotten
+        self.state.setdefault(url, {})['seen'] = seen
+
+    def mark_seen(self, url, key, published):
+        self.state.setdefault(url, {}).setdefault('seen', {})[key] = published
+
+    def clear_validators(self, url):
+        feed = self.state.get(url, {})
+        feed.pop('etag', None)
+        feed.pop('modified', None)
@@ -1,11 +1,15 @@
 import pandas as pd
 import streamlit as st
 import altair as alt
-import json
 import toml
 import os
-from clustering import cluster_articles
+import hashlib
+from clustering import cluster_articles, load_cluster_index
+from features import load_features
 from collections import Counter
+from cache import CACHE_BACKEND, article_facets
+from snapshot import filter_snapshot, load_snapshot, snapshot_facets
+from search import load_search_index
 
 # PAGE FORMAT
 st.set_page_config(layout='wide', initial_sidebar_state='expanded')
@@ -37,27 +41,48 @@ st.markdown(f'<h1 class="primary">Giki News for People in a Hurry!</h1>', unsafe
 # Load the JSON file with article data
 file_path = 'article_cache.json'
 
-@st.cache_data
-def load_data():
-    with open(file_path, 'r') as f:
-        data = json.load(f)
-    return data
+@st.cache_resource(ttl=600)
+def load_table():
+    # Memory-mapped columnar snapshot of the article metadata; bodies are never loaded here
+    return load_snapshot(file_path)
 
-# Load the data from the JSON file
-original_data = load_data()
+# Same ttl as the table, so articles the scraper publishes show up in the filters and charts
+@st.cache_data(ttl=600)
+def load_facets():
+    # SQLite answers from its indexes, without mapping the snapshot
+    return article_facets() if CACHE_BACKEND == 'sqlite' else snapshot_facets(load_table())
 
-# Extract necessary data from the loaded JSON
-articles = list(original_data.values())
+@st.cache_data(ttl=600)
+def load_data(sources, sentiments):
+    return filter_snapshot(load_table(), sources=list(sources), sentiments=list(sentiments)).to_pylist()
+
+@st.cache_data(ttl=600)
+def load_index():
+    return load_cluster_index()
+
+# KMeans fits are shared across sessions, keyed by the filtered article IDs rather than
+# the widget state, so any filter combination yielding the same articles is a lookup.
+# The title feature store's corpus version is part of the key, since IDF moves with it.
+@st.cache_data(max_entries=int(os.getenv('TITLE_CLUSTER_CACHE_SIZE', 128)))
+def cached_title_clusters(filter_key, corpus_version, num_clusters, _titles, _urls):
+    return cluster_articles(_titles, num_clusters, _urls)
+
+@st.cache_resource(ttl=600)
+def load_search():
+    return load_search_index(file_path)
+
+# Only the sidebar options are needed up front; articles are queried once the filters are known
+facets = load_facets()
 
 st.sidebar.image("app\logo.png", use_column_width=True)  
 
 search_topic = st.sidebar.text_input("Search for a topic")
 selected_sentiment = st.sidebar.multiselect(
     "Select Sentiment Category",
-    options=list(set(article['sentiment_category'] for article in articles)),
-    default=list(set(article['sentiment_category'] for article in articles))
+    options=facets['sentiments'],
+    default=facets['sentiments']
 )
-all_sources = list(set(article['source'] for article in articles))
+all_sources = facets['sources']
 selected_sources = st.sidebar.multiselect(
     "Select Sources",
     options=all_sources,
@@ -69,11 +94,11 @@ if not selected_sources:
     selected_sources = all_sources
 
 # Filter articles based on the search topic, selected sentiment category, and selected sources
+articles = load_data(tuple(selected_sources), tuple(selected_sentiment)) if selected_sentiment else []
+search_matches = load_search().search(search_topic)
 filtered_articles = [
     article for article in articles 
-    if (search_topic.lower() in article['title'].lower() or search_topic.lower() in article['body'].lower())
-    and article['sentiment_category'] in selected_sentiment
-    and article['source'] in selected_sources
+    if search_matches is None or article['url'] in search_matches
 ]
 
 # Extract necessary data from the filtered articles
@@ -178,16 +203,37 @@ else:
     else:
         num_clusters = 12
 
-    # Cluster articles based on filtered titles
-    clusters = cluster_articles(filtered_titles, num_clusters)
-
-    # Calculate most frequent keywords for each cluster
-    cluster_keywords = {}
-    for cluster_id, titles in clusters.items():
-        cluster_articles = [article for article in filtered_articles if article['title'] in titles]
-        keywords = [keyword for article in cluster_articles for keyword in article.get('keywords', [])]
-        most_common_keywords = [keyword for keyword, _ in Counter(keywords).most_common(3)]
-        cluster_keywords[cluster_id] = most_common_keywords
+    # Syndicated copies of an article that is also shown count once in the cluster list
+    filtered_urls = {article['url'] for article in filtered_articles}
+    distinct_articles = [article for article in filtered_articles if article.get('duplicate_of') not in filtered_urls]
+
+    cluster_index = load_index()
+    if cluster_index:
+        # Group the filtered articles by their precomputed story and show the largest ones
+        grouped = {}
+        for article in distinct_articles:
+            cluster_id = cluster_index['articles'].get(article['url'])
+            if cluster_id is not None:
+                grouped.setdefault(int(cluster_id), []).append(article['title'])
+        largest = sorted(grouped, key=lambda cluster_id: len(grouped[cluster_id]), reverse=True)[:num_clusters]
+        clusters = {cluster_id: grouped[cluster_id] for cluster_id in largest}
+        cluster_keywords = {cluster_id: cluster_index['clusters'][str(cluster_id)]['keywords'][:3] for cluster_id in clusters}
+    else:
+        # No index yet (clustering.py has not run): cluster articles based on filtered titles
+        filter_key = hashlib.sha1('\n'.join(article['url'] for article in distinct_articles).encode()).hexdigest()
+        title_features = load_features('title')
+        corpus_version = title_features.corpus_version if title_features else 0
+        clusters = cached_title_clusters(filter_key, corpus_version, num_clusters,
+                                         [article['title'] for article in distinct_articles],
+                                         [article['url'] for article in distinct_articles])
+
+        # Calculate most frequent keywords for each cluster
+        cluster_keywords = {}
+        for cluster_id, titles in clusters.items():
+            cluster_members = [article for article in distinct_articles if article['title'] in titles]
+            keywords = [keyword for article in cluster_members for keyword in article.get('keywords', [])]
+            most_common_keywords = [keyword for keyword, _ in Counter(keywords).most_common(3)]
+            cluster_keywords[cluster_id] = most_common_keywords
 
     # Store filtered_articles and clusters in session state for access on another page
     st.session_state.filtered_articles = filtered_articles
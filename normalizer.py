@@ -0,0 +1,88 @@
+import os
+import re
+import string
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from nltk.corpus import stopwords
+from nltk.stem import SnowballStemmer
+from nltk.tokenize import word_tokenize
+from unidecode import unidecode
+
+# Single-pass replacement for the lowercase -> stopwords -> punctuation -> digits ->
+# unidecode -> word_tokenize -> stem chain that clean_articles used to run as
+# separate DataFrame passes. Output is identical to that chain.
+
+STEM_CACHE_SIZE = int(os.getenv('STEM_CACHE_SIZE', 100000))
+PARALLEL_THRESHOLD = int(os.getenv('NORMALIZE_PARALLEL_THRESHOLD', 2000))
+
+PUNCTUATION_TABLE = str.maketrans('', '', string.punctuation)
+
+# Text made only of these characters tokenizes to a plain whitespace split
+PLAIN_TEXT = re.compile(r'[a-z \t\n\r]*')
+
+SENTENCE_PUNCTUATION = re.compile(r'[.?!]')
+
+# Words the NLTK tokenizer splits even without punctuation ("cannot" -> "can not")
+TOKENIZER_CONTRACTIONS = {'cannot', 'gimme', 'gonna', 'gotta', 'lemme', 'wanna', 'whaddya', 'whatcha'}
+
+stemmer = SnowballStemmer(language='english')
+
+@lru_cache(maxsize=1)
+def stop_words():
+    return frozenset(stopwords.words('english'))
+
+@lru_cache(maxsize=STEM_CACHE_SIZE)
+def stem(token):
+    return stemmer.stem(token)
+
+def strip_token(word):
+    word = word.translate(PUNCTUATION_TABLE)
+    return unidecode(''.join(c for c in word if not c.isdigit()))
+
+@lru_cache(maxsize=STEM_CACHE_SIZE)
+def normalize_word(word, at_start=False):
+    # Stems for one whitespace-separated word, or None if it needs the whole text tokenized
+    plain = strip_token(word)
+    if PLAIN_TEXT.fullmatch(plain):
+        pieces = plain.split()
+        if not any(piece in TOKENIZER_CONTRACTIONS for piece in pieces):
+            return tuple(stem(piece) for piece in pieces)
+    # Sentence-ending punctuation tokenizes differently depending on the neighbouring words;
+    # anything else unidecode produces (quotes, dashes, "it's") only depends on whether a
+    # word precedes it, which a placeholder word reproduces
+    if SENTENCE_PUNCTUATION.search(plain):
+        return None
+    if at_start:
+        return tuple(stem(token) for token in word_tokenize(plain))
+    return tuple(stem(token) for token in word_tokenize(f'a {plain}')[1:])
+
+def normalize_text_reference(text):
+    # The original multi-pass chain, used when a word falls off the fast path
+    text = text.lower()
+    text = ' '.join([word for word in text.split() if word.lower() not in stop_words()])
+    text = text.translate(PUNCTUATION_TABLE)
+    text = ''.join([i for i in text if not i.isdigit()])
+    text = unidecode(text)
+    return ' '.join([stem(y) for y in word_tokenize(text)])
+
+def normalize_text(text):
+    words = stop_words()
+    stems = []
+    at_start = True
+    for word in text.lower().split():
+        if word in words:
+            continue
+        word_stems = normalize_word(word, at_start)
+        if word_stems is None:
+            return normalize_text_reference(text)
+        stems.extend(word_stems)
+        at_start = False
+    return ' '.join(stems)
+
+def normalize_texts(texts, workers=None):
+    # Large corpora are split across a process pool; each worker keeps its own stem cache
+    texts = list(texts)
+    if workers == 1 or len(texts) < PARALLEL_THRESHOLD:
+        return [normalize_text(text) for text in texts]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(normalize_text, texts, chunksize=64))
@@ -9,21 +9,32 @@
 # from collections import Counter
 # import altair as alt
 
-import pandas as pd
 import streamlit as st
-import json
 import toml
-from clustering import cluster_articles
-from collections import Counter
+from clustering import cluster_articles, load_cluster_index
+import pyarrow as pa
+import pyarrow.compute as pc
+from snapshot import fetch_text, load_snapshot
 
 # Load the JSON file with article data
 file_path = 'article_cache.json'
 
-@st.cache_data
+@st.cache_resource(ttl=600)
 def load_data():
-    with open(file_path, 'r') as f:
-        data = json.load(f)
-    return data
+    # Memory-mapped article headers, shared by all sessions; bodies live in the blob file
+    return load_snapshot(file_path)
+
+def load_headers(table, urls):
+    headers = table.filter(pc.is_in(table['url'], value_set=pa.array(urls, pa.string()))).to_pylist()
+    return {article['url']: article for article in headers}
+
+def load_body(url):
+    # One body, read from its offset in the blob when the reader expands the article
+    return fetch_text([url], ['body'], file_path).get(url, {}).get('body', '')
+
+@st.cache_data(ttl=600)
+def load_index():
+    return load_cluster_index()
 
 # Load configuration from TOML file
 config = toml.load('config.toml')
@@ -50,48 +61,65 @@ st.markdown(f"""
 st.sidebar.image("app\logo.png", use_column_width=True) 
 
 # Check if cluster ID is provided
-cluster_id = int(st.query_params.get('cluster_id', [0])[0])
-
-# Load data from the JSON file
-original_data = load_data()
-
-# Extract necessary data from the loaded JSON
-articles = list(original_data.values())
-
-# Re-cluster the articles
-filtered_titles = [article['title'] for article in articles]
-
-# Determine the number of clusters dynamically
-filtered_total_articles = len(filtered_titles)
-if filtered_total_articles == 0:
-    st.write("No articles found")
-elif 0 < filtered_total_articles <= 10:
-    num_clusters = 3
-elif 10 < filtered_total_articles <= 50:
-    num_clusters = 5
-elif 50 < filtered_total_articles <= 100:
-    num_clusters = 7
+cluster_id = int(st.query_params.get('cluster_id', 0))
+
+# Load the article headers
+table = load_data()
+
+cluster_index = load_index()
+if cluster_index:
+    # Members come straight from the index written by clustering.py
+    members = cluster_index['clusters'].get(str(cluster_id), {}).get('members', [])
+    clusters = {cluster_id: members} if members else {}
+    headers = load_headers(table, members)
+    selected_articles = [headers[url] for url in members if url in headers]
 else:
-    num_clusters = 12
-
-# Cluster articles based on titles
-clusters = cluster_articles(filtered_titles, num_clusters)
+    # Re-cluster the articles
+    filtered_titles = table['title'].to_pylist()
+
+    # Determine the number of clusters dynamically
+    filtered_total_articles = len(filtered_titles)
+    if filtered_total_articles == 0:
+        st.write("No articles found")
+    elif 0 < filtered_total_articles <= 10:
+        num_clusters = 3
+    elif 10 < filtered_total_articles <= 50:
+        num_clusters = 5
+    elif 50 < filtered_total_articles <= 100:
+        num_clusters = 7
+    else:
+        num_clusters = 12
+
+    # Cluster articles based on titles
+    clusters = cluster_articles(filtered_titles, num_clusters, table['url'].to_pylist())
+    selected_titles = set(clusters.get(cluster_id, []))
+    selected_urls = [url for url, title in zip(table['url'].to_pylist(), filtered_titles) if title in selected_titles]
+    selected_articles = list(load_headers(table, selected_urls).values())
+
+# Syndicated copies fold into the original they duplicate
+selected_urls = {article['url'] for article in selected_articles}
+also_published_by = {}
+for article in selected_articles:
+    if article.get('duplicate_of') in selected_urls:
+        also_published_by.setdefault(article['duplicate_of'], set()).add(article['source'])
+selected_articles = [article for article in selected_articles if article.get('duplicate_of') not in selected_urls]
 
 # Get articles in the selected cluster
 if cluster_id in clusters:
-    cluster_articles = [article for article in articles if article['title'] in clusters[cluster_id]]
-
     # Display articles in the cluster
     st.title(f"Articles in Cluster {cluster_id + 1}")
 
-    for article in cluster_articles:
+    for article in selected_articles:
         st.markdown(f"## {article['title']}")
         st.image(article.get('image_url', ''), use_column_width=True)
         st.markdown(f"**Source:** {article.get('source', 'N/A')}")
         st.markdown(f"**Published on:** {article.get('published_date', 'N/A')}")
-        st.markdown(article['body'])
+        if st.toggle("Show full article", key=f"body-{article['url']}"):
+            st.markdown(load_body(article['url']))
         st.markdown(f"**Frequent Words:** {', '.join(article.get('keywords', []))}")
         st.markdown(f"**Sentiment:** {article.get('sentiment_category', 'N/A')}")
+        if article['url'] in also_published_by:
+            st.markdown(f"**Also published by:** {', '.join(sorted(also_published_by[article['url']]))}")
         st.markdown("---")
 else:
     st.write(f"No articles found for cluster {cluster_id + 1}.")
@@ -0,0 +1,210 @@
+import atexit
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import queue
+import resource
+import threading
+import time
+import tracemalloc
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', 5 * 1024 * 1024))
+LOG_BACKUPS = int(os.getenv('LOG_BACKUPS', 3))
+
+# PROFILE=1 runs the script under cProfile and tracemalloc, with the reports written next to its log
+PROFILE = os.getenv('PROFILE', '0') == '1'
+
+# Upper bounds in seconds of the latency histogram buckets; the last bucket is open-ended
+LATENCY_BUCKETS = (0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# Summary of the run in progress, for code that is not handed one (the clustering helpers)
+active = None
+
+def summary_path(log_file):
+    # scrapper.log -> scrapper_runs.jsonl, one summary line per run
+    base, _ = os.path.splitext(log_file)
+    return f'{base}_runs.jsonl'
+
+def setup_logging(log_file):
+    # Callers only put records on a queue; one listener thread formats them and writes
+    # the rotating file, so a slow disk never stalls the download threads
+    file_handler = RotatingFileHandler(log_file, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS)
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, file_handler, respect_handler_level=True)
+    root = logging.getLogger()
+    root.handlers = [QueueHandler(log_queue)]
+    root.setLevel(LOG_LEVEL)
+    listener.start()
+    # Flush what is still queued when the process exits
+    atexit.register(listener.stop)
+    return listener
+
+def cpu_time():
+    # CPU of the calling thread, plus on the main thread that of worker processes it has reaped,
+    # so a stage that fans out to a process pool is charged for its workers
+    if threading.current_thread() is threading.main_thread():
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        return time.thread_time() + children.ru_utime + children.ru_stime
+    return time.thread_time()
+
+@contextmanager
+def stopwatch(timings, stage):
+    # For code running in worker processes: (wall, cpu) goes into a dict returned to the parent
+    wall, cpu = time.perf_counter(), time.thread_time()
+    try:
+        yield
+    finally:
+        timings[stage] = (time.perf_counter() - wall, time.thread_time() - cpu)
+
+@contextmanager
+def timed(stage, source=None):
+    summary = active
+    if summary is None:
+        yield
+    else:
+        with summary.stage(stage, source):
+            yield
+
+class StageStats:
+    def __init__(self):
+        self.count = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def add(self, wall, cpu):
+        self.count += 1
+        self.wall += wall
+        self.cpu += cpu
+        self.max = max(self.max, wall)
+        self.buckets[bisect_left(LATENCY_BUCKETS, wall)] += 1
+
+    def as_dict(self):
+        labels = [f'<={bound}' for bound in LATENCY_BUCKETS] + [f'>{LATENCY_BUCKETS[-1]}']
+        return {
+            'count': self.count,
+            'wall': round(self.wall, 3),
+            'cpu': round(self.cpu, 3),
+            'mean': round(self.wall / self.count, 4) if self.count else 0.0,
+            'max': round(self.max, 4),
+            'histogram': {label: n for label, n in zip(labels, self.buckets) if n},
+        }
+
+class RunSummary:
+    # Counters and stage timings for one run, logged and appended to a JSONL file at the
+    # end in place of a log line per feed entry or article. Counters and timings can also
+    # be attributed to a source. Safe to update from threads.
+    def __init__(self, counters=()):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.counters = Counter({name: 0 for name in counters})
+        self.failures = Counter()  # domain -> failed downloads
+        self.stages = defaultdict(StageStats)
+        self.source_counters = defaultdict(Counter)
+        self.source_stages = defaultdict(lambda: defaultdict(StageStats))
+        self.extra = {}
+
+    def activate(self):
+        global active
+        active = self
+        return self
+
+    def count(self, name, n=1, source=None):
+        with self.lock:
+            self.counters[name] += n
+            if source:
+                self.source_counters[source][name] += n
+
+    def failure(self, domain):
+        with self.lock:
+            self.failures[domain] += 1
+
+    def record(self, stage, wall, cpu=0.0, source=None):
+        with self.lock:
+            self.stages[stage].add(wall, cpu)
+            if source:
+                self.source_stages[source][stage].add(wall, cpu)
+
+    @contextmanager
+    def stage(self, name, source=None):
+        wall, cpu = time.perf_counter(), cpu_time()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - wall, cpu_time() - cpu, source)
+
+    def as_dict(self):
+        with self.lock:
+            sources = sorted(set(self.source_counters) | set(self.source_stages))
+            return {
+                'started_at': datetime.fromtimestamp(self.started, timezone.utc).isoformat(),
+                'duration': round(time.time() - self.started, 3),
+                **dict(self.counters),
+                'failures_by_domain': dict(self.failures.most_common()),
+                'stages': {stage: stats.as_dict() for stage, stats in self.stages.items()},
+                'sources': {
+                    source: {
+                        **dict(self.source_counters[source]),
+                        'stages': {stage: stats.as_dict() for stage, stats in self.source_stages[source].items()},
+                    }
+                    for source in sources
+                },
+                **self.extra,
+            }
+
+    def write(self, summary_file):
+        summary = self.as_dict()
+        logging.info(f'Run summary: {json.dumps(summary)}')
+        with open(summary_file, 'a') as f:
+            f.write(json.dumps(summary) + '\n')
+        return summary
+
+class Profiler:
+    # cProfile sees the main thread only; download threads and worker processes show up
+    # in the run summary's stage timings instead
+    def __init__(self, log_file):
+        base, _ = os.path.splitext(log_file)
+        self.base = base
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        tracemalloc.start(10)
+        self.profile.enable()
+
+    def stop(self, top=40):
+        self.profile.disable()
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        self.profile.dump_stats(f'{self.base}_profile.prof')
+        report = io.StringIO()
+        pstats.Stats(self.profile, stream=report).sort_stats('cumulative').print_stats(top)
+        with open(f'{self.base}_profile.txt', 'w') as f:
+            f.write(report.getvalue())
+
+        with open(f'{self.base}_memory.txt', 'w') as f:
+            f.write(f'Current: {current / 1024 ** 2:.1f} MiB, peak: {peak / 1024 ** 2:.1f} MiB\n\n')
+            for stat in snapshot.statistics('lineno')[:top]:
+                f.write(f'{stat}\n')
+        logging.info(f'Wrote profile reports to {self.base}_profile.txt and {self.base}_memory.txt')
+
+def start_profiling(log_file):
+    # None unless PROFILE=1
+    if not PROFILE:
+        return None
+    profiler = Profiler(log_file)
+    profiler.start()
+    return profiler
@@ -0,0 +1,80 @@
+import logging
+import os
+import random
+import time
+
+# Seconds between polls of one feed. Each feed starts at POLL_INTERVAL and moves between
+# the bounds with the rate it has been producing new entries.
+POLL_INTERVAL = int(os.getenv('POLL_INTERVAL', 30 * 60))
+POLL_MIN_INTERVAL = int(os.getenv('POLL_MIN_INTERVAL', 5 * 60))
+POLL_MAX_INTERVAL = int(os.getenv('POLL_MAX_INTERVAL', 6 * 60 * 60))
+
+# Poll about once per this many expected new entries
+POLL_TARGET_ENTRIES = float(os.getenv('POLL_TARGET_ENTRIES', 2))
+
+# Weight of the latest poll in the per-feed rate, and how much a poll with nothing new
+# stretches the interval once the rate has decayed to nothing
+RATE_SMOOTHING = 0.3
+EMPTY_POLL_GROWTH = 1.5
+
+# Each wait is moved by up to this fraction either way, so feeds that share a site drift apart
+POLL_JITTER = float(os.getenv('POLL_JITTER', 0.1))
+
+class FeedScheduler:
+    # When each feed is next due. The schedule lives in FeedState next to the feed's
+    # validators and seen entries, so a restarted daemon keeps what it learned:
+    # interval (seconds), rate (new entries per second, smoothed), last_poll and
+    # next_poll (epoch seconds) and errors (failed polls in a row, for backoff).
+    def __init__(self, feed_urls, feed_state, rng=None):
+        self.feed_urls = list(dict.fromkeys(feed_urls))
+        self.feed_state = feed_state
+        self.rng = rng or random.Random()
+        now = time.time()
+        for url in self.feed_urls:
+            feed = self.feed_state.get_feed(url)
+            if 'next_poll' not in feed:
+                # Spread the first polls of feeds never scheduled over their first interval,
+                # so they do not all land on the same tick again and again
+                self.feed_state.update_feed(url, interval=POLL_INTERVAL, next_poll=now + self.rng.uniform(0, POLL_INTERVAL))
+            elif feed['next_poll'] > now + POLL_MAX_INTERVAL:
+                # Bounds lowered since the last run
+                self.feed_state.update_feed(url, next_poll=now + self.jittered(POLL_MAX_INTERVAL))
+
+    def jittered(self, interval):
+        return interval * self.rng.uniform(1 - POLL_JITTER, 1 + POLL_JITTER)
+
+    def due(self, now=None):
+        now = time.time() if now is None else now
+        due = [url for url in self.feed_urls if self.feed_state.get_feed(url).get('next_poll', 0) <= now]
+        return sorted(due, key=lambda url: self.feed_state.get_feed(url)['next_poll'])
+
+    def next_due(self):
+        return min((self.feed_state.get_feed(url).get('next_poll', 0) for url in self.feed_urls), default=None)
+
+    def record(self, url, new_entries, error=False, now=None):
+        # Reschedule a feed after polling it
+        now = time.time() if now is None else now
+        feed = self.feed_state.get_feed(url)
+        interval = feed.get('interval', POLL_INTERVAL)
+        if error:
+            # Back off exponentially on failed polls; the learned interval is kept for when it recovers
+            errors = feed.get('errors', 0) + 1
+            wait = min(POLL_MAX_INTERVAL, interval * 2 ** errors)
+            self.feed_state.update_feed(url, errors=errors, next_poll=now + self.jittered(wait))
+            logging.info(f'Feed failed {errors} time(s) in a row, next poll in {wait:.0f}s: {url}')
+            return wait
+
+        elapsed = now - feed['last_poll'] if feed.get('last_poll') else interval
+        observed = new_entries / max(elapsed, 1)
+        rate = feed.get('rate')
+        rate = observed if rate is None else RATE_SMOOTHING * observed + (1 - RATE_SMOOTHING) * rate
+        if new_entries:
+            interval = POLL_TARGET_ENTRIES / rate
+        else:
+            # Nothing new: wait at least as long as the rate suggests, and longer each time
+            interval = max(interval * EMPTY_POLL_GROWTH, POLL_TARGET_ENTRIES / rate if rate else 0)
+        interval = min(POLL_MAX_INTERVAL, max(POLL_MIN_INTERVAL, interval))
+        self.feed_state.update_feed(url, interval=round(interval), rate=rate, errors=0,
+                                    last_poll=now, next_poll=now + self.jittered(interval))
+        logging.debug(f'{new_entries} new entries, next poll in {interval:.0f}s: {url}')
+        return interval
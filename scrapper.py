@@ -1,174 +1,376 @@
 import feedparser as fp
-import dateutil.parser
 from newspaper import Article, Config
+from newspaper import nlp as newspaper_nlp
 import logging
 import pandas as pd
 import json
+import math
 from datetime import datetime, timedelta, timezone
 from textblob import TextBlob
 import os
-from nltk.corpus import stopwords
-from nltk.stem import SnowballStemmer
-import string
-from nltk.tokenize import word_tokenize
-from unidecode import unidecode
 import time
 import threading
+import signal
 import sys
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from urllib.parse import urlparse
+from cache import apply_retention, create_cache_manager
+from canonical import UrlAliases, canonical_url, source_rules
+from dates import PATHS as DATE_PATHS, DateNormalizer
+from dedup import DuplicateIndex
+from features import FEATURE_STORE, build_feature_stores
+from feed_state import FeedState, entry_key
+from normalizer import normalize_texts
+from scheduler import FeedScheduler
+from run_log import RunSummary, cpu_time, setup_logging, start_profiling, stopwatch, summary_path
+from search import build_search_index
+from snapshot import write_snapshot
 
-# Set up logging configuration
-logging.basicConfig(filename='scrapper.log', level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+# Bump when clean_articles or the sentiment scoring changes so stored articles get reprocessed
+PIPELINE_VERSION = 1
 
-class CacheManager:
-    def __init__(self, cache_file='article_cache.json'):
-        self.cache_file = cache_file
-        self.load_cache()
-    
-    def load_cache(self):
-        logging.info("Loading cache")
-        if os.path.exists(self.cache_file):
-            with open(self.cache_file, 'r') as f:
-                self.cache = json.load(f)
-        else:
-            logging.info("Cache file not found, creating a new one")
-            self.cache = {}
-            self.save_cache()  # Create an empty cache file if it doesn't exist
-    
-    def save_cache(self):
-        logging.info("Saving cache")
-        with open(self.cache_file, 'w') as f:
-            json.dump(self.cache, f, indent=4)
-    
-    def get_article(self, url):
-        return self.cache.get(url, None)
-    
-    def add_article(self, url, article_data):
-        logging.info(f'Adding article to cache: {url}')
-        self.cache[url] = article_data
-        self.save_cache()
+LOG_FILE = os.getenv('SCRAPER_LOG_FILE', 'scrapper.log')
+
+# `python scrapper.py --daemon` keeps polling feeds on their own schedules instead of scraping once
+DAEMON = '--daemon' in sys.argv
+# Seconds between rebuilds of the snapshot, search index and feature stores while new articles come in
+PUBLISH_INTERVAL = int(os.getenv('PUBLISH_INTERVAL', 5 * 60))
+# Also refresh the story clusters on each publish, as entrypoint.sh does after a one-off run
+DAEMON_CLUSTERING = os.getenv('DAEMON_CLUSTERING', '1') == '1'
+
+# Reported in every run summary, even when zero
+RUN_COUNTERS = (
+    'feeds_polled', 'feeds_not_modified', 'feed_errors', 'entries_seen', 'entries_already_handled',
+    'entries_undated', 'entries_too_old', 'cache_hits', 'downloads', 'downloaded', 'duplicates', 'new_articles',
+)
 
 class Scraper:
-    def __init__(self, sources, days, cache_manager):
+    def __init__(self, sources, days, cache_manager, max_workers=8, per_domain_limit=2, feed_state=None, analysis_workers=None, duplicate_index=None, aliases=None):
         self.sources = sources
         self.days = days
         self.cache_manager = cache_manager
+        self.feed_state = feed_state
+        self.max_workers = max_workers
+        self.per_domain_limit = per_domain_limit
+        self.analysis_workers = analysis_workers
+        self.duplicate_index = duplicate_index
+        self.aliases = aliases
+        self.dates = DateNormalizer()
+        self.run = RunSummary(RUN_COUNTERS)
+
+    def download_article(self, link, domain_slots, source=None):
+        domain = urlparse(link).netloc
+        try:
+            logging.debug(f'Processing article: {link}')
+            content = Article(link, config=config)
+            # Cap simultaneous connections per site; waiting for a slot is not download time
+            with domain_slots[domain], self.run.stage('download', source):
+                content.download()
+            if not content.html:
+                raise Exception(content.download_exception_msg or 'empty response')
+            self.run.count('downloaded', source=source)
+            return content.html
+        except Exception as e:
+            logging.error(f'Error downloading/parsing article: {e}')
+            self.run.failure(domain)
+        return None
 
-    def scrape(self):
+    def record_timings(self, timings, source):
+        # Stage timings measured inside a worker process
+        for stage, (wall, cpu) in timings.items():
+            self.run.record(stage, wall, cpu, source)
+
+    def scrape(self, feeds=None):
+        # feeds limits this run to those feed urls, for the daemon polling the ones due
         start_time = time.time()  # Start time of scraping
-        articles_list = []
         new_articles_count = 0
         now = datetime.now(timezone.utc)
+        self.dates.stats.clear()
+        self.run = RunSummary(RUN_COUNTERS)
+        self.feed_results = {}  # feed url -> new entries found and whether polling it failed
         
-        # Define a tzinfos dictionary for handling timezone abbreviations
-        tzinfos = {
-            'EDT': timezone(timedelta(hours=-4)),  # Example mapping
-            'EST': timezone(timedelta(hours=-5)),
-            'CDT': timezone(timedelta(hours=-5)),
-            'CST': timezone(timedelta(hours=-6)),
-            'MDT': timezone(timedelta(hours=-6)),
-            'MST': timezone(timedelta(hours=-7)),
-            'PDT': timezone(timedelta(hours=-7)),
-            'PST': timezone(timedelta(hours=-8)),
-        }
-        
+        # Each slot is either a cached article or the link of a pending download,
+        # so articles_list keeps feed order no matter when downloads finish
+        slots = []
+        pending = {}
+        pending_feeds = defaultdict(set)
+        pending_entries = defaultdict(list)  # pending link -> (feed url, entry key, published) to mark seen once stored
+        canonical_links = {}  # pending link -> its canonical url
+        pending_canonical = {}  # canonical url -> the pending link downloading it
+        alias_hits = 0
         for source, content in self.sources.items():
+            feed_urls = [url for url in content['rss'] if feeds is None or url in feeds]
+            if not feed_urls:
+                continue
             logging.info(f'Source: {source}')
-            for url in content['rss']:
-                logging.info(f'Processing RSS feed: {url}')
+            rules = content.get('canonical', {})
+            for url in feed_urls:
+                logging.debug(f'Processing RSS feed: {url}')
+                self.run.count('feeds_polled', source=source)
+                # Send the validators from the last run so unchanged feeds answer 304
+                feed = self.feed_state.get_feed(url) if self.feed_state else {}
                 try:
-                    d = fp.parse(url)
+                    with self.run.stage('feed_fetch', source):
+                        d = fp.parse(url, etag=feed.get('etag'), modified=feed.get('modified'))
                 except Exception as e:
                     logging.error(f'Error parsing RSS feed {url}: {e}')
+                    self.run.count('feed_errors', source=source)
+                    self.feed_results[url] = {'new': 0, 'error': True}
+                    continue
+                
+                if getattr(d, 'status', None) == 304:
+                    logging.debug(f'Feed not modified since last run: {url}')
+                    self.run.count('feeds_not_modified', source=source)
+                    self.feed_results[url] = {'new': 0, 'error': False}
+                    continue
+                # feedparser reports network errors and bad responses in the result rather than raising
+                if getattr(d, 'status', 200) >= 400 or (d.get('bozo') and not d.entries):
+                    logging.error(f'Error fetching RSS feed {url}: {d.get("bozo_exception") or d.status}')
+                    self.run.count('feed_errors', source=source)
+                    self.feed_results[url] = {'new': 0, 'error': True}
                     continue
+                self.run.count('entries_seen', len(d.entries), source)
+                if self.feed_state:
+                    self.feed_state.update_feed(url, etag=d.get('etag'), modified=d.get('modified'))
                 
+                # Entries handled on an earlier run are skipped before any date parsing or lookups.
+                # Everything resolved here (old, undated, cached) is remembered; new articles
+                # are added once they are stored, so failed downloads are retried.
+                known = self.feed_state.seen_entries(url) if self.feed_state else {}
+                seen = {}
+                skipped = 0
+                new_entries = 0
                 for entry in d.entries:
-                    if not hasattr(entry, 'published'):
-                        logging.warning(f'Entry missing "published" attribute: {entry}')
+                    key = entry_key(entry.get('id') or entry.get('link', ''))
+                    if key in known:
+                        seen[key] = known[key]
+                        skipped += 1
                         continue
                     
-                    try:
-                        article_date = dateutil.parser.parse(getattr(entry, 'published'), tzinfos=tzinfos)
-                        article_date = article_date.astimezone(timezone.utc)
-                        logging.info(f'Found article with date: {article_date}')
-                    except Exception as e:
-                        logging.error(f'Error parsing article date: {e}')
+                    if not self.dates.has_date(entry):
+                        logging.debug(f'Entry missing "published" attribute: {entry}')
+                        self.run.count('entries_undated', source=source)
+                        seen[key] = 0
+                        continue
+                    
+                    with self.run.stage('date_parse', source):
+                        article_date = self.dates.parse_entry(entry, url)
+                    if article_date is None:
+                        seen[key] = 0
                         continue
+                    logging.debug(f'Found article with date: {article_date}')
                     
-                    if now - article_date <= timedelta(days=self.days):
-                        cached_article = self.cache_manager.get_article(entry.link)
+                    published = int(article_date.timestamp())
+                    if now - article_date > timedelta(days=self.days):
+                        self.run.count('entries_too_old', source=source)
+                        seen[key] = published
+                    else:
+                        new_entries += 1
+                        link = entry.link
+                        canonical = canonical_url(link, rules)
+                        cached_article = self.cache_manager.get_article(link)
+                        # The same article under another tracking parameter, scheme or AMP variant
+                        alias = self.aliases.get(canonical) if self.aliases and not cached_article else None
+                        if alias and alias != link:
+                            cached_article = self.cache_manager.get_article(alias)
+                            alias_hits += bool(cached_article)
                         if cached_article:
-                            logging.info(f'Using cached article: {entry.link}')
-                            articles_list.append(cached_article)
+                            logging.debug(f'Using cached article: {link}')
+                            self.run.count('cache_hits', source=source)
+                            slots.append(('cached', cached_article))
+                            seen[key] = published
                             continue
                         
-                        try:
-                            logging.info(f'Processing article: {entry.link}')
-                            content = Article(entry.link, config=config)
-                            content.download()
-                            content.parse()
-                            content.nlp()
-                            try:
-                                sentiment = TextBlob(content.text).sentiment.polarity
-                                sentiment_category = 'positive' if sentiment > 0 else 'neutral' if sentiment == 0 else 'negative'
-                                
-                                article = {
-                                    'source': source,
-                                    'url': entry.link,
-                                    'date': article_date.strftime('%Y-%m-%d'),
-                                    'time': article_date.strftime('%H:%M:%S %Z'),
-                                    'title': content.title,
-                                    'body': content.text,
-                                    'summary': content.summary,
-                                    'keywords': content.keywords,
-                                    'image_url': content.top_image,
-                                    'sentiment': sentiment,
-                                    'sentiment_category': sentiment_category
-                                }
-                                
-                                articles_list.append(article)
-                                self.cache_manager.add_article(entry.link, article)
-                                new_articles_count += 1
-                            except Exception as e:
-                                logging.error(f'Error processing article: {e}')
-                                logging.info('Continuing...')
-                        except Exception as e:
-                            logging.error(f'Error downloading/parsing article: {e}')
-                            logging.info('Continuing...')
+                        link = pending_canonical.setdefault(canonical, link)
+                        if link not in pending:
+                            self.run.count('downloads', source=source)
+                            pending[link] = (source, article_date)
+                            canonical_links[link] = canonical
+                        pending_feeds[link].add(url)
+                        pending_entries[link].append((url, key, published))
+                        slots.append(('pending', link))
+                
+                self.run.count('entries_already_handled', skipped, source)
+                self.feed_results[url] = {'new': new_entries, 'error': False}
+                if self.feed_state:
+                    logging.debug(f'Skipped {skipped} of {len(d.entries)} entries already handled in {url}')
+                    self.feed_state.set_seen(url, seen)
+        articles_start = time.perf_counter(), cpu_time()
+        
+        domain_slots = defaultdict(lambda: threading.Semaphore(self.per_domain_limit))
+        for link in pending:
+            domain_slots[urlparse(link).netloc]
+        
+        # Downloads run on threads; parse() and then nlp() and sentiment run on a process
+        # pool as each previous stage lands, so the stages overlap. Between parse and
+        # scoring, near-duplicates of an already scored article reuse its analysis.
+        fetched = {}
+        parsed = {}
+        copies = defaultdict(list)  # link being scored -> links waiting to reuse its analysis
+        
+        def store(link, analysis):
+            source, article_date = pending[link]
+            article = {
+                'source': source,
+                'url': link,
+                'date': article_date.strftime('%Y-%m-%d'),
+                'time': article_date.strftime('%H:%M:%S %Z'),
+                **analysis
+            }
+            fetched[link] = article
+            self.cache_manager.add_article(link, article)
+            self.run.count('new_articles', source=source)
+        
+        with ThreadPoolExecutor(max_workers=self.max_workers) as downloader, \
+                ProcessPoolExecutor(max_workers=self.analysis_workers) as analyzer:
+            running = {downloader.submit(self.download_article, link, domain_slots, pending[link][0]): ('download', link) for link in pending}
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage, link = running.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        logging.error(f'Error processing article: {e}')
+                        self.run.count(f'{stage}_failures', source=pending[link][0])
+                        # Copies waiting on this article get scored themselves
+                        for copy in copies.pop(link, []):
+                            running[analyzer.submit(score_article, parsed[copy]['title'], parsed[copy]['body'])] = ('score', copy)
+                        continue
+                    
+                    if stage == 'download':
+                        if result:
+                            running[analyzer.submit(parse_article, link, result)] = ('parse', link)
+                    elif stage == 'parse':
+                        self.record_timings(result.pop('timings'), pending[link][0])
+                        # The page's own rel=canonical link is one more name for this article
+                        page_canonical = result.pop('canonical_link', None)
+                        if self.aliases:
+                            self.aliases.add(canonical_links[link], link)
+                            if page_canonical:
+                                self.aliases.add(canonical_url(page_canonical, self.sources[pending[link][0]].get('canonical', {})), link)
+                        parsed[link] = result
+                        original = self.duplicate_index.check(link, result['title'], result['body']) if self.duplicate_index else None
+                        original_article = fetched.get(original) or (self.cache_manager.get_article(original) if original else None)
+                        if original:
+                            self.run.count('duplicates', source=pending[link][0])
+                        if original in copies:
+                            logging.debug(f'Duplicate of {original}, waiting for its analysis: {link}')
+                            copies[original].append(link)
+                        elif original_article and original_article.get('sentiment') is not None:
+                            logging.debug(f'Duplicate of {original}, reusing its analysis: {link}')
+                            store(link, {**result, **reused_analysis(original_article), 'duplicate_of': original})
+                            new_articles_count += 1
+                        else:
+                            copies[link] = []
+                            running[analyzer.submit(score_article, result['title'], result['body'])] = ('score', link)
+                    else:
+                        self.record_timings(result.pop('timings'), pending[link][0])
+                        store(link, {**parsed[link], **result})
+                        new_articles_count += 1
+                        for copy in copies.pop(link, []):
+                            store(copy, {**parsed[copy], **reused_analysis(fetched[link]), 'duplicate_of': link})
+                            new_articles_count += 1
+        
+        self.run.record('articles', time.perf_counter() - articles_start[0], cpu_time() - articles_start[1])
+        
+        if self.feed_state:
+            # A feed with failed downloads must be fetched in full next run so they get retried
+            for link, feed_urls in pending_feeds.items():
+                if link not in fetched:
+                    for feed_url in feed_urls:
+                        self.feed_state.clear_validators(feed_url)
+            for link, entries in pending_entries.items():
+                if link in fetched:
+                    for feed_url, key, published in entries:
+                        self.feed_state.mark_seen(feed_url, key, published)
+            self.feed_state.save_state()
+        
+        articles_list = []
+        for kind, value in slots:
+            if kind == 'cached':
+                articles_list.append(value)
+            elif value in fetched:
+                articles_list.append(fetched[value])
+        
         end_time = time.time()  # End time of scraping
         duration = end_time - start_time  # Calculate duration
         logging.info(f'Scraping completed in {duration:.2f} seconds')
         print(f'Scraping completed in {duration:.2f} seconds')
         logging.info(f'Total new articles scraped: {new_articles_count}')
         print(f'Total new articles scraped: {new_articles_count}')
+        if self.aliases:
+            self.run.count('alias_hits', alias_hits)
+        self.run.extra['date_paths'] = {path: self.dates.stats[path] for path in DATE_PATHS}
+        self.run.record('scrape', duration)
         return articles_list
 
+def classify_sentiment(polarity):
+    if polarity > 0:
+        return 'positive'
+    elif polarity == 0:
+        return 'neutral'
+    else:
+        return 'negative'
+
+def parse_article(link, html):
+    # Runs in a worker process: extract the text from the downloaded page
+    timings = {}
+    with stopwatch(timings, 'parse'):
+        content = Article(link, config=config)
+        content.download(input_html=html)
+        content.parse()
+    return {
+        'title': content.title,
+        'body': content.text,
+        'image_url': content.top_image,
+        'canonical_link': content.canonical_link,
+        'timings': timings,
+    }
+
+def score_article(title, body):
+    # Runs in a worker process: what Article.nlp() does, plus sentiment, on extracted text
+    timings = {}
+    with stopwatch(timings, 'nlp'):
+        newspaper_nlp.load_stopwords(config.get_language())
+        keywords = list(set(list(newspaper_nlp.keywords(body).keys()) + list(newspaper_nlp.keywords(title).keys())))
+        summary = '\n'.join(newspaper_nlp.summarize(title=title, text=body, max_sents=config.MAX_SUMMARY_SENT))
+    with stopwatch(timings, 'sentiment'):
+        sentiment = TextBlob(body).sentiment.polarity
+    return {
+        'summary': summary,
+        'keywords': keywords,
+        'sentiment': sentiment,
+        'sentiment_category': classify_sentiment(sentiment),
+        'timings': timings,
+    }
+
+def reused_analysis(original):
+    return {field: original.get(field) for field in ('summary', 'keywords', 'sentiment', 'sentiment_category')}
+
 def clean_articles(news_df):
-    news_df['clean_body'] = news_df['body'].str.lower()
-    stop_words = set(stopwords.words('english'))
-    news_df['clean_body'] = news_df['clean_body'].apply(lambda x: ' '.join([word for word in x.split() if word.lower() not in stop_words]))
-    news_df['clean_body'] = news_df['clean_body'].apply(lambda x: x.translate(str.maketrans('', '', string.punctuation)))
-    news_df['clean_body'] = news_df['clean_body'].apply(lambda x: ''.join([i for i in x if not i.isdigit()]))
-    news_df['clean_body'] = news_df['clean_body'].apply(unidecode)
-    news_df['clean_body'] = news_df['clean_body'].apply(word_tokenize)
-    stemmer = SnowballStemmer(language='english')
-    news_df['clean_body'] = news_df['clean_body'].apply(lambda x: ' '.join([stemmer.stem(y) for y in x]))
+    news_df['clean_body'] = normalize_texts(news_df['body'])
 
     return news_df
 
+def is_nan(value):
+    return isinstance(value, float) and math.isnan(value)
+
+def needs_processing(article):
+    # Records cleaned before versioning was introduced count as version 1. Records saved
+    # with NaN in fields they lacked, by an earlier DataFrame round trip, get repaired too.
+    return (article.get('pipeline_version', 1) != PIPELINE_VERSION
+            or not isinstance(article.get('clean_body'), str)
+            or article.get('sentiment') is None
+            or any(is_nan(value) for value in article.values()))
+
 def sentiment_analysis(articles):
     logging.info("Performing sentiment analysis")
     
     articles_df = pd.DataFrame(articles)
     articles_df['sentiment'] = articles_df['body'].apply(lambda x: TextBlob(x).sentiment.polarity)
     
-    def classify_sentiment(polarity):
-        if polarity > 0:
-            return 'positive'
-        elif polarity == 0:
-            return 'neutral'
-        else:
-            return 'negative'
-    
     articles_df['sentiment_category'] = articles_df['sentiment'].apply(classify_sentiment)
     
     return articles_df[['url', 'sentiment', 'sentiment_category']]
@@ -190,41 +392,166 @@ def show_blinking_message():
     sys.stdout.write("\rScraping completed!\n")
     sys.stdout.flush()
 
+def save_scrape_state(duplicate_index, aliases):
+    if duplicate_index:
+        duplicate_index.save_state()
+    if aliases:
+        aliases.save_state()
+
+def post_process(cache_manager, run):
+    # Only clean and score what has not been processed at the current pipeline version.
+    # Feed entries seen on earlier runs are no longer returned by scrape(), so the
+    # store itself is checked.
+    stale = {url: article for url, article in cache_manager.iter_articles() if needs_processing(article)}
+    logging.info(f'{len(stale)} articles need post-processing')
+    run.count('post_processed', len(stale))
+    
+    with run.stage('post_processing'):
+        if stale:
+            # Fields are merged into the stored records; a DataFrame round trip would give every
+            # record the fields only some have, as NaN
+            articles = [{key: value for key, value in article.items() if not is_nan(value)} for article in stale.values()]
+            with run.stage('clean_articles'):
+                clean_bodies = clean_articles(pd.DataFrame({'body': [article.get('body') for article in articles]}))['clean_body']
+            
+            # Sentiment is scored once while scraping; only backfill records that predate it
+            missing = [article for article in articles if article.get('sentiment') is None]
+            if missing:
+                with run.stage('sentiment_backfill'):
+                    sentiment_df = sentiment_analysis(missing)
+                for article, sentiment, category in zip(missing, sentiment_df['sentiment'], sentiment_df['sentiment_category']):
+                    article.update(sentiment=sentiment, sentiment_category=category)
+            for article, clean_body in zip(articles, clean_bodies):
+                article.update(clean_body=clean_body, pipeline_version=PIPELINE_VERSION)
+            
+            # Save cleaned and analyzed articles to cache in one write
+            cache_manager.add_articles(articles)
+    return len(stale)
+
+def publish(cache_manager, run, clusters=False):
+    # Rebuild what the app reads from the article store. Expired articles move out to the
+    # archive; removing them already writes a fresh snapshot, otherwise the journal written
+    # since is folded into one for the readers.
+    with run.stage('retention'):
+        if not apply_retention(cache_manager):
+            cache_manager.compact()
+    if FEATURE_STORE:
+        with run.stage('feature_store'):
+            build_feature_stores(cache_manager.iter_articles())
+    with run.stage('search_index'):
+        build_search_index()
+    with run.stage('snapshot'):
+        write_snapshot()
+    if clusters:
+        # What entrypoint.sh runs after a one-off scrape; imported here as it pulls in sklearn
+        from clustering import main as update_clusters
+        with run.stage('clustering'):
+            update_clusters(run)
+
+def run_daemon(scraper, scheduler, cache_manager, duplicate_index=None, aliases=None):
+    # Polls each feed when the scheduler has it due and stores its new articles right away.
+    # The files the app reads are rebuilt at most every PUBLISH_INTERVAL seconds, and only
+    # when articles came in. SIGTERM or Ctrl-C finish the current poll and publish first.
+    stop = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: stop.set())
+    if not scheduler.feed_urls:
+        logging.warning('No feeds configured, scraper daemon not started')
+        return
+    logging.info(f'Scraper daemon started with {len(scheduler.feed_urls)} feeds')
+    last_publish = time.time()
+    unpublished = 0
+    while True:
+        due = [] if stop.is_set() else scheduler.due()
+        run = RunSummary()
+        published = False
+        try:
+            if due:
+                logging.info(f'Polling {len(due)} due feeds')
+                try:
+                    scraper.scrape(set(due))
+                finally:
+                    run = scraper.run
+                    # Feeds the scrape never got to count as failed polls
+                    for url in due:
+                        result = scraper.feed_results.get(url, {'new': 0, 'error': True})
+                        scheduler.record(url, result['new'], result['error'])
+                    scraper.feed_state.save_state()
+                save_scrape_state(duplicate_index, aliases)
+                unpublished += run.counters['new_articles'] + post_process(cache_manager, run)
+            if unpublished and (stop.is_set() or time.time() - last_publish >= PUBLISH_INTERVAL):
+                published = True
+                publish(cache_manager, run, DAEMON_CLUSTERING)
+                unpublished = 0
+                last_publish = time.time()
+        except Exception as e:
+            logging.error(f'An error occurred: {e}')
+            run.count('errors')
+        if due or published:
+            run.write(summary_path(LOG_FILE))
+        if stop.is_set():
+            break
+        
+        # Sleep until the next feed is due, or until the pending articles can be published
+        wakes = [scheduler.next_due()] + ([last_publish + PUBLISH_INTERVAL] if unpublished else [])
+        wakes = [wake for wake in wakes if wake is not None]
+        if not wakes:
+            break
+        stop.wait(max(1.0, min(wakes) - time.time()))
+    logging.info('Scraper daemon stopped')
+
 if __name__ == '__main__':
+    setup_logging(LOG_FILE)
+    profiler = start_profiling(LOG_FILE)
     logging.info("Starting main script")
     with open('app/sources.json', 'r') as file:
         sources = json.load(file)
     
     days_to_scrape = int(os.getenv('DAYS_TO_SCRAPE', 7))
+    max_workers = int(os.getenv('SCRAPE_WORKERS', 8))
+    per_domain_limit = int(os.getenv('SCRAPE_PER_DOMAIN', 2))
+    analysis_workers = int(os.getenv('ANALYSIS_WORKERS', 0)) or None  # None uses every core
     
-    cache_manager = CacheManager()
+    use_journal = os.getenv('CACHE_JOURNAL', '1') == '1'
+    cache_manager = create_cache_manager(journal=use_journal)
     
-    scraper_done = False  # Flag to indicate when scraping is done
-    blinking_thread = threading.Thread(target=show_blinking_message)
-    blinking_thread.start()
+    feed_state = FeedState() if os.getenv('FEED_STATE', os.getenv('CONDITIONAL_GET', '1')) == '1' else None
+    if DAEMON and not feed_state:
+        # The daemon keeps its schedule, and the entries it has handled, in the feed state
+        feed_state = FeedState()
+    duplicate_index = DuplicateIndex() if os.getenv('DEDUP', '1') == '1' else None
+    if duplicate_index and not duplicate_index.urls:
+        duplicate_index.seed(cache_manager.iter_articles())
+    aliases = UrlAliases() if os.getenv('URL_ALIASES', '1') == '1' else None
+    if aliases and not aliases.aliases:
+        aliases.seed(cache_manager.iter_articles(), source_rules(sources))
+    scraper = Scraper(sources, days_to_scrape, cache_manager, max_workers, per_domain_limit, feed_state, analysis_workers, duplicate_index, aliases)
     
-    scraper = Scraper(sources, days_to_scrape, cache_manager)
-    try:
-        articles = scraper.scrape()
-        scraper_done = True  # Set flag to True to stop the blinking message
+    if DAEMON:
+        scheduler = FeedScheduler([url for content in sources.values() for url in content['rss']], feed_state)
+        run_daemon(scraper, scheduler, cache_manager, duplicate_index, aliases)
+    else:
+        scraper_done = False  # Flag to indicate when scraping is done
+        blinking_thread = threading.Thread(target=show_blinking_message)
+        blinking_thread.start()
         
-        if not articles:
-            logging.warning('No articles were scraped.')
-        else:
-            logging.info(f'{len(articles)} articles scraped.')
-            news_df = pd.DataFrame(articles)
-            news_df = clean_articles(news_df)
-            
-            sentiment_df = sentiment_analysis(articles)
+        try:
+            articles = scraper.scrape()
+            save_scrape_state(duplicate_index, aliases)
+            scraper_done = True  # Set flag to True to stop the blinking message
             
-            news_df.drop(columns=['sentiment', 'sentiment_category'], inplace=True, errors='ignore')
-
-            news_df = pd.merge(news_df, sentiment_df[['url', 'sentiment', 'sentiment_category']], on='url')
-            
-            # Save cleaned and analyzed articles to cache
-            for article in news_df.to_dict(orient='records'):
-                cache_manager.add_article(article['url'], article)
+            if not articles:
+                logging.warning('No articles were scraped.')
+            else:
+                logging.info(f'{len(articles)} articles scraped.')
             
-    except Exception as e:
-        logging.error(f'An error occurred: {e}')
-        scraper_done = True  # Set flag to True if an error occurs
+            post_process(cache_manager, scraper.run)
+            publish(cache_manager, scraper.run)
+                
+        except Exception as e:
+            logging.error(f'An error occurred: {e}')
+            scraper.run.count('errors')
+            scraper_done = True  # Set flag to True if an error occurs
+        scraper.run.write(summary_path(LOG_FILE))
+    if profiler:
+        profiler.stop()
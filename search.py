@@ -0,0 +1,139 @@
+import logging
+import os
+import pickle
+import re
+from array import array
+
+from cache import CACHE_FILE, load_articles, replace_file
+
+SEARCH_INDEX_FILE = os.getenv('SEARCH_INDEX_FILE', 'search_index.pkl')
+
+TOKEN_PATTERN = re.compile(r'\w+')
+QUERY_PATTERN = re.compile(r'"([^"]*)"|(\S+)')
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower())
+
+class SearchIndex:
+    # Token-level inverted index over title and body. Each token's postings list the
+    # documents containing it and the token positions, for phrase queries. Postings are
+    # packed into flat arrays so the saved index loads quickly; articles added later
+    # sit in a small dict until the next freeze().
+    def __init__(self, articles=None):
+        self.urls = []
+        self.doc_ids = {}
+        self.terms = {}  # token -> (first, last) slice of doc_table
+        self.doc_table = array('I')
+        self.position_starts = array('Q', [0])  # positions of doc_table[i] are positions[starts[i]:starts[i + 1]]
+        self.positions = array('I')
+        self.pending = {}  # token -> {doc_id: positions} not yet packed
+        for url, article in (articles or {}).items():
+            self.add_article(url, article)
+        self.freeze()
+
+    def add_article(self, url, article):
+        if url in self.doc_ids:
+            self.remove_article(url)
+        doc_id = len(self.urls)
+        self.urls.append(url)
+        self.doc_ids[url] = doc_id
+        # Title and body are one token stream, with a gap so phrases cannot span the two
+        tokens = tokenize(article.get('title') or '') + [None] + tokenize(article.get('body') or '')
+        for position, token in enumerate(tokens):
+            if token is None:
+                continue
+            self.pending.setdefault(token, {}).setdefault(doc_id, []).append(position)
+
+    def remove_article(self, url):
+        # The document id is left as a tombstone and dropped from the postings on the next freeze
+        doc_id = self.doc_ids.pop(url)
+        self.urls[doc_id] = None
+
+    def freeze(self):
+        tokens = sorted(set(self.terms) | set(self.pending))
+        postings = [(token, self.docs_for(token)) for token in tokens]
+        self.terms = {}
+        self.doc_table = array('I')
+        self.position_starts = array('Q', [0])
+        self.positions = array('I')
+        for token, docs in postings:
+            first = len(self.doc_table)
+            for doc_id in sorted(docs):
+                if self.urls[doc_id] is None:
+                    continue
+                self.doc_table.append(doc_id)
+                self.positions.extend(docs[doc_id])
+                self.position_starts.append(len(self.positions))
+            if len(self.doc_table) > first:
+                self.terms[token] = (first, len(self.doc_table))
+        self.pending = {}
+
+    def doc_set(self, token):
+        first, last = self.terms.get(token, (0, 0))
+        docs = set(self.doc_table[first:last])
+        docs.update(self.pending.get(token, ()))
+        return docs
+
+    def doc_count(self, token):
+        first, last = self.terms.get(token, (0, 0))
+        return last - first + len(self.pending.get(token, ()))
+
+    def docs_for(self, token):
+        docs = {}
+        first, last = self.terms.get(token, (0, 0))
+        for i in range(first, last):
+            docs[self.doc_table[i]] = self.positions[self.position_starts[i]:self.position_starts[i + 1]]
+        docs.update(self.pending.get(token, {}))
+        return docs
+
+    def match_phrase(self, terms):
+        postings = [self.docs_for(term) for term in terms]
+        candidates = set.intersection(*(set(docs) for docs in postings)) if postings else set()
+        matches = set()
+        for doc_id in candidates:
+            starts = set(postings[0][doc_id])
+            for offset, docs in enumerate(postings[1:], start=1):
+                starts &= {position - offset for position in docs[doc_id]}
+                if not starts:
+                    break
+            if starts:
+                matches.add(doc_id)
+        return matches
+
+    def search(self, query):
+        # Every bare term and every "quoted phrase" must match (AND). Returns the
+        # matching urls, or None for an empty query meaning no filtering.
+        clauses = []
+        for phrase, term in QUERY_PATTERN.findall(query or ''):
+            terms = tokenize(phrase or term)
+            if terms:
+                clauses.append(terms)
+        if not clauses:
+            return None
+
+        # Start from the rarest clause so the candidate set shrinks fastest
+        clauses.sort(key=lambda terms: min(self.doc_count(term) for term in terms))
+        matches = None
+        for terms in clauses:
+            docs = self.doc_set(terms[0]) if len(terms) == 1 else self.match_phrase(terms)
+            matches = docs if matches is None else matches & docs
+            if not matches:
+                break
+        return {self.urls[doc_id] for doc_id in matches if self.urls[doc_id] is not None}
+
+def build_search_index(cache_file=CACHE_FILE, index_file=SEARCH_INDEX_FILE):
+    logging.info("Building search index")
+    index = SearchIndex(load_articles(cache_file))
+    replace_file(index_file, lambda f: pickle.dump(index, f, protocol=pickle.HIGHEST_PROTOCOL))
+    return index
+
+def load_search_index(cache_file=CACHE_FILE, index_file=SEARCH_INDEX_FILE):
+    # The index as the scraper last published it; only built here when there is none yet
+    # or it cannot be read
+    if os.path.exists(index_file):
+        try:
+            with open(index_file, 'rb') as f:
+                return pickle.load(f)
+        except Exception as e:
+            logging.warning(f'Error loading search index, rebuilding: {e}')
+    return build_search_index(cache_file, index_file)
@@ -0,0 +1,156 @@
+import json
+import logging
+import os
+import time
+import uuid
+import zlib
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.feather as feather
+
+from cache import CACHE_FILE, load_articles, replace_file
+
+# Columnar copy of the metadata the UI filters and charts on. Stored as an
+# uncompressed Arrow IPC file so readers can memory-map it instead of parsing JSON.
+# The text fields go to a companion blob file, one compressed record per article,
+# located through the text_offset/text_length columns of the snapshot.
+# Only the scraper writes them; readers serve whatever was last published.
+SNAPSHOT_FILE = os.getenv('SNAPSHOT_FILE', 'article_snapshot.arrow')
+
+SNAPSHOT_VERSION = 4
+
+# Each write gets a generation id, kept in the snapshot metadata and at the start of the
+# blob, so a reader can tell a snapshot and a blob from different writes apart
+GENERATION_LENGTH = 32
+
+TEXT_FIELDS = ('body', 'summary', 'clean_body')
+
+SNAPSHOT_SCHEMA = pa.schema([
+    ('url', pa.string()),
+    ('source', pa.string()),
+    ('date', pa.string()),
+    ('time', pa.string()),
+    ('title', pa.string()),
+    ('sentiment', pa.float64()),
+    ('sentiment_category', pa.string()),
+    ('keywords', pa.list_(pa.string())),
+    ('image_url', pa.string()),
+    ('duplicate_of', pa.string()),
+    ('text_offset', pa.uint64()),
+    ('text_length', pa.uint32()),
+])
+
+HEADER_FIELDS = [name for name in SNAPSHOT_SCHEMA.names if name not in ('text_offset', 'text_length')]
+
+def text_path(snapshot_file):
+    base, _ = os.path.splitext(snapshot_file)
+    return f'{base}.blob'
+
+def write_text_blob(articles, blob_file, generation):
+    def write(f):
+        offsets, lengths = [], []
+        f.write(generation.encode())
+        for article in articles:
+            record = zlib.compress(json.dumps({field: article.get(field) or '' for field in TEXT_FIELDS}).encode())
+            offsets.append(f.tell())
+            lengths.append(len(record))
+            f.write(record)
+        return offsets, lengths
+    return replace_file(blob_file, write)
+
+def write_snapshot(cache_file=CACHE_FILE, snapshot_file=SNAPSHOT_FILE):
+    logging.info("Writing columnar snapshot")
+    generation = uuid.uuid4().hex
+    articles = list(load_articles(cache_file).values())
+    columns = {
+        field.name: [article.get(field.name) for article in articles]
+        for field in SNAPSHOT_SCHEMA
+    }
+    # Anything but a string in a string column, such as NaN in a record that lacked the field, is null
+    for field in SNAPSHOT_SCHEMA:
+        if field.type == pa.string():
+            columns[field.name] = [value if isinstance(value, str) else None for value in columns[field.name]]
+    columns['sentiment'] = [value if isinstance(value, (int, float)) else None for value in columns['sentiment']]
+    columns['keywords'] = [list(keywords) if isinstance(keywords, list) else [] for keywords in columns['keywords']]
+    # The blob goes first, so a snapshot on disk never points past the end of its blob
+    columns['text_offset'], columns['text_length'] = write_text_blob(articles, text_path(snapshot_file), generation)
+    metadata = {'generation': generation, 'version': str(SNAPSHOT_VERSION)}
+    table = pa.table(columns, schema=SNAPSHOT_SCHEMA.with_metadata(metadata))
+    replace_file(snapshot_file, lambda f: feather.write_feather(table, f, compression='uncompressed'))
+    return table
+
+def snapshot_generation(table):
+    return (table.schema.metadata or {}).get(b'generation', b'').decode()
+
+def load_snapshot(cache_file=CACHE_FILE, snapshot_file=SNAPSHOT_FILE):
+    # Memory-mapped table as last published; only built here when there is none yet
+    # or it was written in an older layout
+    if os.path.exists(snapshot_file):
+        table = feather.read_table(snapshot_file, memory_map=True)
+        if (table.schema.metadata or {}).get(b'version') == str(SNAPSHOT_VERSION).encode():
+            return table
+    write_snapshot(cache_file, snapshot_file)
+    return feather.read_table(snapshot_file, memory_map=True)
+
+def snapshot_facets(table):
+    # Same shape as cache.article_facets, answered from the columns
+    if table.num_rows == 0:
+        return {'count': 0, 'sources': [], 'sentiments': [], 'min_date': None, 'max_date': None}
+    dates = pc.min_max(table['date'])
+    return {
+        'count': table.num_rows,
+        'sources': sorted(pc.unique(table['source']).drop_null().to_pylist()),
+        'sentiments': sorted(pc.unique(table['sentiment_category']).drop_null().to_pylist()),
+        'min_date': dates['min'].as_py(),
+        'max_date': dates['max'].as_py(),
+    }
+
+def filter_snapshot(table, start_date=None, end_date=None, sources=None, sentiments=None):
+    mask = None
+    conditions = []
+    if start_date:
+        conditions.append(pc.greater_equal(table['date'], str(start_date)))
+    if end_date:
+        conditions.append(pc.less_equal(table['date'], str(end_date)))
+    if sources:
+        conditions.append(pc.is_in(table['source'], value_set=pa.array(list(sources), pa.string())))
+    if sentiments:
+        conditions.append(pc.is_in(table['sentiment_category'], value_set=pa.array(list(sentiments), pa.string())))
+    for condition in conditions:
+        mask = condition if mask is None else pc.and_(mask, condition)
+    return table if mask is None else table.filter(mask)
+
+# url -> row of the snapshot generation last read, built once per generation
+url_rows = (None, {})
+
+def row_index(table):
+    global url_rows
+    generation = snapshot_generation(table)
+    if url_rows[0] != generation:
+        url_rows = (generation, {url: row for row, url in enumerate(table['url'].to_pylist())})
+    return url_rows[1]
+
+def read_text(f, offset, length):
+    f.seek(offset)
+    return json.loads(zlib.decompress(f.read(length)))
+
+def fetch_text(urls, fields=('body', 'summary'), cache_file=CACHE_FILE, snapshot_file=SNAPSHOT_FILE, attempts=20):
+    # Text fields for just the given articles, read from the blob at their recorded offsets.
+    # The offsets are only good for the blob of the same write: when a writer has replaced
+    # the blob but not yet the snapshot, wait for its snapshot.
+    urls = list(urls)
+    for _ in range(attempts):
+        table = load_snapshot(cache_file, snapshot_file)
+        with open(text_path(snapshot_file), 'rb') as f:
+            if f.read(GENERATION_LENGTH).decode() != snapshot_generation(table):
+                time.sleep(0.05)
+                continue
+            index = row_index(table)
+            wanted = sorted({index[url] for url in urls if url in index})
+            rows = table.select(['url', 'text_offset', 'text_length']).take(pa.array(wanted, pa.int64())).to_pylist()
+            texts = {}
+            for row in rows:
+                text = read_text(f, row['text_offset'], row['text_length'])
+                texts[row['url']] = {field: text.get(field, '') for field in fields}
+            return texts
+    raise RuntimeError(f'{snapshot_file} and its text blob are from different writes')
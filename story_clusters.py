@@ -0,0 +1,152 @@
+import json
+import logging
+import os
+import time
+import numpy as np
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.preprocessing import normalize
+
+from clustering import cluster_tfidf
+from features import load_features
+from run_log import timed
+
+STORY_STATE_FILE = os.getenv('STORY_STATE_FILE', 'story_clusters.json')
+
+# Cosine similarity to a story centroid needed to join it instead of starting a new story
+STORY_SIMILARITY = float(os.getenv('STORY_SIMILARITY', 0.35))
+
+# Full re-clustering corrects centroid drift after this many online assignments or seconds
+RECLUSTER_EVERY = int(os.getenv('RECLUSTER_EVERY', 1000))
+RECLUSTER_INTERVAL = int(os.getenv('RECLUSTER_INTERVAL', 7 * 24 * 3600))
+
+# A hashing vectorizer has no fitted vocabulary, so vectors from different runs share one space
+N_FEATURES = 2 ** 18
+vectorizer = HashingVectorizer(n_features=N_FEATURES, alternate_sign=False, norm='l2')
+
+class StoryClusterer:
+    def __init__(self, state_file=STORY_STATE_FILE, similarity=STORY_SIMILARITY):
+        self.state_file = state_file
+        self.centroid_file = f'{os.path.splitext(state_file)[0]}.npz'
+        self.similarity = similarity
+        self.load_state()
+
+    def load_state(self):
+        self.assignments = {}  # article url -> story id
+        self.counts = []  # members per story
+        self.sums = sp.csr_matrix((0, N_FEATURES))  # per-story sum of member vectors
+        self.online_assignments = 0
+        self.last_full_cluster = 0.0
+        if not (os.path.exists(self.state_file) and os.path.exists(self.centroid_file)):
+            return
+        logging.info("Loading story cluster state")
+        with open(self.state_file, 'r') as f:
+            state = json.load(f)
+        self.assignments = state['assignments']
+        self.counts = state['counts']
+        self.online_assignments = state['online_assignments']
+        self.last_full_cluster = state['last_full_cluster']
+        self.sums = sp.load_npz(self.centroid_file).tocsr()
+
+    def save_state(self):
+        logging.info("Saving story cluster state")
+        state = {
+            'assignments': self.assignments,
+            'counts': self.counts,
+            'online_assignments': self.online_assignments,
+            'last_full_cluster': self.last_full_cluster,
+        }
+        tmp_file = f'{self.state_file}.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_file, self.state_file)
+        sp.save_npz(self.centroid_file, self.sums)
+
+    def needs_full_cluster(self):
+        return (not self.counts
+                or self.online_assignments >= RECLUSTER_EVERY
+                or time.time() - self.last_full_cluster >= RECLUSTER_INTERVAL)
+
+    def full_cluster(self, urls, texts):
+        logging.info(f"Re-clustering {len(urls)} articles from scratch")
+        with timed('compute_tfidf'):
+            vectors = self.vectorize(urls, texts)
+        labels = cluster_tfidf(vectors)
+        self.assignments = dict(zip(urls, labels.tolist()))
+        self.sums = self.member_sums(labels, vectors, len(set(labels.tolist())))
+        self.counts = np.bincount(labels).tolist()
+        self.online_assignments = 0
+        self.last_full_cluster = time.time()
+
+    def vectorize(self, urls, texts):
+        # A feature store in hashing mode holds these same vectors, already counted by the scraper
+        features = load_features('clean_body')
+        if features is not None and features.hashing:
+            return features.term_vectors(urls, texts)
+        return vectorizer.transform(texts)
+
+    def member_sums(self, labels, vectors, n_stories):
+        membership = sp.csr_matrix((np.ones(len(labels)), (labels, np.arange(len(labels)))), shape=(n_stories, len(labels)))
+        return (membership @ vectors).tocsr()
+
+    def assign(self, urls, texts):
+        logging.info(f"Assigning {len(urls)} new articles to stories")
+        with timed('compute_tfidf'):
+            vectors = self.vectorize(urls, texts)
+        n_existing = len(self.counts)
+        similarities = (vectors @ normalize(self.sums).T).toarray() if n_existing else np.zeros((len(urls), 0))
+        # Stories started in this batch, so later articles in the batch can join them. A new
+        # story's sum is the sum of its members' unit vectors, so an article's dot product with
+        # it is a sum over the batch's Gram matrix, and its squared norm is kept as members join.
+        gram = (vectors @ vectors.T).toarray()
+        new_labels = np.full(len(urls), -1)
+        new_norms = []  # squared norm of each new story's sum
+        labels = []
+        for i, url in enumerate(urls):
+            best_story, best_similarity = -1, -1.0
+            if n_existing:
+                best_story = int(similarities[i].argmax())
+                best_similarity = similarities[i, best_story]
+            if new_norms:
+                joined = new_labels[:i] >= 0
+                dots = np.bincount(new_labels[:i][joined], weights=gram[:i, i][joined], minlength=len(new_norms))
+                norms = np.sqrt(new_norms)
+                new_similarities = np.divide(dots, norms, out=np.zeros_like(dots), where=norms > 0)
+                j = int(new_similarities.argmax())
+                if new_similarities[j] > best_similarity:
+                    best_story, best_similarity = n_existing + j, new_similarities[j]
+            if best_similarity < self.similarity:
+                best_story = n_existing + len(new_norms)
+                new_norms.append(gram[i, i])
+            elif best_story >= n_existing:
+                new_norms[best_story - n_existing] += 2 * dots[best_story - n_existing] + gram[i, i]
+            if best_story >= n_existing:
+                new_labels[i] = best_story - n_existing
+            labels.append(best_story)
+            self.assignments[url] = best_story
+
+        n_new = len(new_norms)
+        n_stories = n_existing + n_new
+        self.sums = sp.vstack([self.sums, sp.csr_matrix((n_new, N_FEATURES))]).tocsr()
+        self.sums = self.sums + self.member_sums(np.array(labels), vectors, n_stories)
+        self.counts = np.bincount(labels, minlength=n_stories) + np.array(self.counts + [0] * n_new, dtype=int)
+        self.counts = self.counts.tolist()
+        self.online_assignments += len(urls)
+
+    def update(self, urls, texts, full=False):
+        # Assign unseen articles to the nearest story, or re-cluster everything when due
+        if full or self.needs_full_cluster():
+            self.full_cluster(urls, texts)
+            return
+        new = [(url, text) for url, text in zip(urls, texts) if url not in self.assignments]
+        if len(new) > RECLUSTER_EVERY:
+            # Would be due right after anyway, and assign() holds the batch's Gram matrix
+            self.full_cluster(urls, texts)
+            return
+        if new:
+            new_urls, new_texts = zip(*new)
+            with timed('cluster_assign'):
+                self.assign(list(new_urls), list(new_texts))
+
+    def labels_for(self, urls):
+        return [self.assignments[url] for url in urls]